@@ -1,21 +1,53 @@
-from flask import Flask, render_template, request, redirect, flash, jsonify, session, url_for
+from flask import Flask, render_template, request, redirect, flash, jsonify, session, url_for, send_file, Response
 from werkzeug.utils import secure_filename
+from werkzeug.http import http_date
 from werkzeug.middleware.proxy_fix import ProxyFix
-from models import db, User, File, SharedFile
+from models import db, User, File, SharedFile, UploadSession, Blob, UserSession, Folder, ChangeEvent, FileText, Posting, Job, Derivative
 from datetime import datetime, timezone
 import boto3
+from botocore.config import Config as BotoConfig
+from boto3.s3.transfer import TransferConfig
 import os
+import io
+import math
+import hashlib
+import mimetypes
+import unicodedata
+import uuid
+import time
+import threading
+import base64
+import json
 import logging
+import queue
+import sys
+import atexit
+import signal
+import multiprocessing
+from collections import Counter, defaultdict
 import watchtower
 import requests
-from jose import jwt, JWTError
+import click
+from jose import JWTError
 from dotenv import load_dotenv
 from config import Config
+from jwks import HTTPKeySource, FileKeySource, JWKSCache, TokenVerifier
+from log_pipeline import BoundedQueueHandler, BatchingQueueListener, local_log_handler
+from session_store import MemorySessionStore, DatabaseSessionStore, ServerSideSessionInterface
+from storage import S3Storage, LocalStorage, StorageError, S3_MAX_DELETE_KEYS
+from zip_stream import ZipEntry, stream_zip, unique_names
+from content_index import can_extract, extract_text, tokenize
+from derivatives import RenderPool, UnsupportedImage, can_render
+from jobs import JobQueue, JobWorker
 from functools import wraps
-from urllib.parse import urlencode
-from sqlalchemy import or_
+from urllib.parse import urlencode, quote
+from sqlalchemy import or_, and_, update, delete, insert, func, literal, case, table, column, literal_column
+from sqlalchemy.orm import joinedload, aliased
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import timedelta
 from flask_migrate import Migrate
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 
 # Load environment variables
 load_dotenv()
@@ -28,25 +60,88 @@ db.init_app(app)
 
 migrate = Migrate(app, db)
 
+# Sessions live server-side; the cookie only carries an opaque session id
+if app.config['SESSION_STORE'] == 'memory':
+    session_store = MemorySessionStore(max_entries=app.config['SESSION_MEMORY_MAX_ENTRIES'])
+else:
+    session_store = DatabaseSessionStore(UserSession.__table__, lambda: db.engine)
+app.session_interface = ServerSideSessionInterface(session_store, ttl=app.config['SESSION_TTL'])
+
 # AWS S3
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 BUCKET = os.getenv("AWS_BUCKET_NAME")
 
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION,
-    endpoint_url=f"https://s3.{AWS_REGION}.amazonaws.com"
-)
+# File content goes through a storage backend: S3, or local disk (e.g. for
+# tests, benchmarks and on-prem nodes) with STORAGE_BACKEND=local
+if app.config['STORAGE_BACKEND'] == 'local':
+    storage = LocalStorage(
+        app.config['LOCAL_STORAGE_ROOT'],
+        app.secret_key,
+        lambda token: url_for('local_file', token=token, _external=True)
+    )
+else:
+    # The pool must cover every request thread's transfer threads, otherwise
+    # urllib3 discards connections ("Connection pool is full") and each
+    # transfer pays a fresh TLS handshake
+    s3_client_config = BotoConfig(
+        max_pool_connections=app.config['S3_MAX_POOL_CONNECTIONS'],
+        retries={'mode': app.config['S3_RETRY_MODE'], 'total_max_attempts': app.config['S3_MAX_ATTEMPTS']},
+        connect_timeout=app.config['S3_CONNECT_TIMEOUT'],
+        read_timeout=app.config['S3_READ_TIMEOUT'],
+        tcp_keepalive=True
+    )
+    s3_transfer_config = TransferConfig(
+        multipart_threshold=app.config['S3_TRANSFER_THRESHOLD'],
+        multipart_chunksize=app.config['S3_TRANSFER_CHUNK_SIZE'],
+        max_concurrency=app.config['S3_TRANSFER_MAX_CONCURRENCY']
+    )
+
+    def make_s3_client():
+        return boto3.client(
+            's3',
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+            region_name=AWS_REGION,
+            endpoint_url=f"https://s3.{AWS_REGION}.amazonaws.com",
+            config=s3_client_config
+        )
 
-# CloudWatch logging
+    storage = S3Storage(make_s3_client, BUCKET, s3_transfer_config)
+
+# CloudWatch logging. Request handlers only put records on a bounded queue;
+# a listener thread formats and ships them, so CloudWatch latency never
+# reaches a request. Falls back to stdout or LOG_FILE without CloudWatch.
 LOG_GROUP = "/algonive/flask"
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-logger.addHandler(watchtower.CloudWatchLogHandler(log_group=LOG_GROUP))
+
+log_sinks = []
+if app.config['LOG_SINK'] == 'cloudwatch':
+    try:
+        log_sinks.append(watchtower.CloudWatchLogHandler(log_group=LOG_GROUP))
+    except Exception as e:
+        print(f"CloudWatch logging unavailable, logging locally: {e}", file=sys.stderr)
+if not log_sinks:
+    log_sinks.append(local_log_handler(app.config['LOG_FILE'] if app.config['LOG_SINK'] == 'file' else None))
+
+log_queue = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+log_listener = BatchingQueueListener(
+    log_queue,
+    log_sinks,
+    batch_size=app.config['LOG_BATCH_SIZE'],
+    flush_interval=app.config['LOG_FLUSH_INTERVAL']
+)
+# The handler starts the listener with the first record in each process
+log_queue_handler = BoundedQueueHandler(
+    log_queue,
+    overflow=app.config['LOG_OVERFLOW'],
+    block_timeout=app.config['LOG_BLOCK_TIMEOUT'],
+    listener=log_listener
+)
+logger.addHandler(log_queue_handler)
+atexit.register(log_listener.stop)
 
 # Cognito
 COGNITO_DOMAIN = os.getenv("COGNITO_DOMAIN")
@@ -54,11 +149,27 @@ COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID")
 COGNITO_CLIENT_SECRET = os.getenv("COGNITO_CLIENT_SECRET")
 COGNITO_REDIRECT_URI = os.getenv("COGNITO_REDIRECT_URI")
 
-# Login decorator
+# ID tokens are verified against Cognito's signing keys, which are fetched
+# once and cached; set COGNITO_JWKS_FILE to verify against a local key set.
+if app.config['COGNITO_JWKS_FILE']:
+    key_source = FileKeySource(app.config['COGNITO_JWKS_FILE'])
+else:
+    key_source = HTTPKeySource(app.config['COGNITO_JWKS_URL'])
+token_verifier = TokenVerifier(
+    JWKSCache(key_source, ttl=app.config['JWKS_CACHE_TTL'], min_refresh_interval=app.config['JWKS_MIN_REFRESH_INTERVAL']),
+    issuer=app.config['COGNITO_ISSUER'],
+    audience=COGNITO_CLIENT_ID
+)
+
+# Login decorator. The ID token was verified once in callback(); the server-side
+# session only needs to outlive the token's expiry.
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'id_token' not in session:
+        if 'user_id' not in session:
+            return redirect('/login')
+        if session.get('expires_at', 0) <= time.time():
+            session.clear()
             return redirect('/login')
         return f(*args, **kwargs)
     return decorated_function
@@ -99,8 +210,17 @@ def callback():
         if not id_token:
             return f"Failed to get id_token. Response: {token_data}", 400
 
-        claims = jwt.get_unverified_claims(id_token)
-        session['id_token'] = id_token
+        try:
+            claims = token_verifier.verify(id_token, token_data.get('access_token'))
+        except JWTError as e:
+            logger.error("Rejected id_token in callback: %s", e)
+            return "Invalid id_token from Cognito", 401
+        # Issue a fresh session id at login so a pre-login id cannot be fixated
+        if session.sid:
+            session_store.delete(session.sid)
+            session.sid = None
+        session.clear()
+        session['expires_at'] = claims['exp']
         session['username'] = claims.get("cognito:username").lower()
         session['email'] = claims.get("email")
 
@@ -112,19 +232,19 @@ def callback():
                 db.session.commit()
             except Exception as e:
                 db.session.rollback()
-                logger.error(f"User creation failed in callback: {e}")
+                logger.error("User creation failed in callback: %s", e)
         session['user_id'] = user.id
-        logger.info(f"User '{session['username']}' logged in via Cognito")
+        logger.info("User '%s' logged in via Cognito", session['username'])
         return redirect('/dashboard')
     except Exception as e:
-        logger.error(f"Callback processing failed: {e}")
+        logger.error("Callback processing failed: %s", e)
         return f"Callback error: {str(e)}", 500
 
 @app.route('/logout')
 def logout():
     username = session.get("username", "Anonymous")
     session.clear()
-    logger.info(f"User '{username}' logged out.")
+    logger.info("User '%s' logged out.", username)
 
     logout_url = f"{COGNITO_DOMAIN}/logout?" + urlencode({
         "client_id": COGNITO_CLIENT_ID,
@@ -132,19 +252,680 @@ def logout():
     })
     return redirect(logout_url)
 
+# Keyset pagination over (uploaded_at, id): a page starts strictly after the
+# last row of the previous one, so deep pages cost the same as the first.
+PAGE_SORTS = ('newest', 'oldest')
+
+def encode_cursor(file):
+    uploaded_at = file.uploaded_at.replace(tzinfo=None).isoformat()
+    return base64.urlsafe_b64encode(json.dumps([uploaded_at, file.id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        uploaded_at, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(uploaded_at), int(file_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def page_params(args):
+    sort = args.get('sort', 'newest')
+    if sort not in PAGE_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(PAGE_SORTS)}")
+    limit = args.get('limit', app.config['PAGE_SIZE'], type=int)
+    return sort, max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+def paginate_files(query, sort, cursor, limit, file_of=lambda row: row):
+    """Return one page of rows from a query over File and the cursor for the
+    next page (None on the last page)."""
+    if cursor:
+        after_uploaded_at, after_id = decode_cursor(cursor)
+        if sort == 'newest':
+            query = query.filter(or_(File.uploaded_at < after_uploaded_at,
+                                     and_(File.uploaded_at == after_uploaded_at, File.id < after_id)))
+        else:
+            query = query.filter(or_(File.uploaded_at > after_uploaded_at,
+                                     and_(File.uploaded_at == after_uploaded_at, File.id > after_id)))
+    order = (File.uploaded_at.desc(), File.id.desc()) if sort == 'newest' else (File.uploaded_at.asc(), File.id.asc())
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = encode_cursor(file_of(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def own_files_page(user_id, sort, cursor, limit):
+    return paginate_files(File.query.filter(File.owner_id == user_id), sort, cursor, limit)
+
+def folder_files_page(user_id, folder_id, sort, cursor, limit):
+    """Like own_files_page, limited to one folder (None is the root)."""
+    query = File.query.filter(File.owner_id == user_id, File.folder_id == folder_id)
+    return paginate_files(query, sort, cursor, limit)
+
+def shared_files_page(user_id, sort, cursor, limit):
+    # Load each share's file and owner in the same query instead of one lazy load per row
+    query = SharedFile.query.join(File, SharedFile.file_id == File.id).filter(
+        SharedFile.shared_with_id == user_id
+    ).options(joinedload(SharedFile.file).joinedload(File.owner))
+    return paginate_files(query, sort, cursor, limit, file_of=lambda shared: shared.file)
+
+def serialize_file(file):
+    return {
+        'id': file.id,
+        'filename': file.filename,
+        'size': file.size,
+        'uploaded_at': file.uploaded_at.isoformat() if file.uploaded_at else None,
+        'owner': file.owner.username,
+        'folder_id': file.folder_id
+    }
+
+# Filename search over the index from models.FILE_SEARCH_DDL. Trigrams need
+# at least three characters, so shorter words only narrow the indexed
+# matches (or, alone, fall back to a scan of the files the user can see).
+file_search = table('file_search', column('rowid'), column('filename'))
+SEARCH_MAX_TERMS = 8
+
+def like_pattern(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_files(user_id, query, limit):
+    """Files the user owns or has been shared whose names contain every word
+    of `query`: exact names first, then prefix matches, then the closest
+    (trigram similarity on PostgreSQL, shortest name on SQLite)."""
+    terms = query.split()[:SEARCH_MAX_TERMS]
+    shared_ids = db.session.query(SharedFile.file_id).filter(SharedFile.shared_with_id == user_id)
+    search = File.query.filter(or_(File.owner_id == user_id, File.id.in_(shared_ids)))
+    indexed = [t for t in terms if len(t) >= 3]
+    dialect = db.session.get_bind().dialect.name
+    rank = []
+    if dialect == 'sqlite' and indexed:
+        # As an IN list the index is read once and files are fetched by
+        # primary key; joined, SQLite may instead walk the user's files and
+        # re-run the match for each one
+        match = ' AND '.join('"' + t.replace('"', '""') + '"' for t in indexed)
+        search = search.filter(File.id.in_(
+            db.session.query(file_search.c.rowid).filter(literal_column('file_search').op('MATCH')(match))
+        ))
+        terms = [t for t in terms if len(t) < 3]
+    elif dialect == 'postgresql':
+        rank = [func.similarity(File.filename, query).desc()]
+    for term in terms:
+        search = search.filter(File.filename.ilike(f"%{like_pattern(term)}%", escape='\\'))
+    return search.options(joinedload(File.owner)).order_by(
+        case((func.lower(File.filename) == query.lower(), 0), else_=1),
+        case((File.filename.ilike(f"{like_pattern(query.split()[0])}%", escape='\\'), 0), else_=1),
+        *rank,
+        func.length(File.filename),
+        File.id
+    ).limit(limit).all()
+
+# Content search. Uploads queue an index-content job that extracts the
+# file's text and stores its words in the posting table; searches only ever
+# read that table.
+def index_file_content(file_id):
+    file = db.session.get(File, file_id)
+    if not file:
+        return
+    max_bytes = app.config['CONTENT_INDEX_MAX_BYTES']
+    db.session.execute(delete(Posting).where(Posting.file_id == file_id))
+    # Identical content that is already indexed is copied, not extracted again
+    twin = db.session.query(FileText.file_id).join(File, File.id == FileText.file_id).filter(
+        File.sha256 == file.sha256, File.id != file.id, FileText.status == 'indexed'
+    ).first() if file.sha256 else None
+    status, term_count = 'indexed', 0
+    if twin:
+        term_count = db.session.execute(insert(Posting).from_select(
+            ['term', 'file_id', 'tf'],
+            db.session.query(Posting.term, literal(file_id), Posting.tf).filter(Posting.file_id == twin.file_id)
+        )).rowcount
+    elif not can_extract(file.filename):
+        status = 'unsupported'
+    elif (file.size or 0) > max_bytes:
+        status = 'too_large'
+    else:
+        stream = storage.open(file.s3_key)
+        try:
+            data = stream.read(max_bytes)
+        finally:
+            stream.close()
+        try:
+            terms = tokenize(extract_text(data, file.filename, max_bytes=max_bytes), app.config['CONTENT_INDEX_MAX_TERMS'])
+        except Exception as e:
+            # Retrying cannot help a document we cannot parse
+            logger.warning("Could not extract text from file %s: %s", file_id, e)
+            status, terms = 'failed', {}
+        if terms:
+            db.session.execute(insert(Posting), [{'term': t, 'file_id': file_id, 'tf': n} for t, n in terms.items()])
+        term_count = len(terms)
+    db.session.merge(FileText(file_id=file_id, status=status, term_count=term_count, indexed_at=datetime.now(timezone.utc)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Deleted while we were extracting
+        db.session.rollback()
+
+def search_content(user_id, query, limit):
+    """Files the user owns or has been shared that contain every word of
+    `query`, ranked by tf-idf."""
+    terms = sorted(tokenize(query, SEARCH_MAX_TERMS))
+    if not terms:
+        return []
+    df = dict(db.session.query(Posting.term, func.count()).filter(Posting.term.in_(terms)).group_by(Posting.term))
+    if len(df) < len(terms):
+        # Some word is in no file at all
+        return []
+    # The highest file id is a free upper bound on the number of files
+    total = db.session.query(func.max(File.id)).scalar() or 1
+    weights = {term: math.log(1 + total / df[term]) for term in terms}
+    score = func.sum(Posting.tf * case(weights, value=Posting.term)).label('score')
+    shared_ids = db.session.query(SharedFile.file_id).filter(SharedFile.shared_with_id == user_id)
+    ranked = db.session.query(Posting.file_id, score).join(File, File.id == Posting.file_id).filter(
+        Posting.term.in_(terms),
+        or_(File.owner_id == user_id, File.id.in_(shared_ids))
+    ).group_by(Posting.file_id).having(func.count() == len(terms)).order_by(score.desc(), Posting.file_id).limit(limit).all()
+    files = {f.id: f for f in File.query.filter(File.id.in_([file_id for file_id, _ in ranked])).options(joinedload(File.owner))}
+    return [files[file_id] for file_id, _ in ranked if file_id in files]
+
+# Thumbnails and previews. Uploads of images (and PDFs) queue a
+# render-derivatives job that renders small JPEGs in a process pool and
+# stores them next to the original under "derivatives/<source key>/", so the
+# dashboard shows kilobytes instead of fetching originals.
+DERIVATIVE_PREFIX = 'derivatives/'
+DERIVATIVE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+render_pool = RenderPool(app.config['RENDER_PROCESSES'], timeout=app.config['RENDER_TIMEOUT'])
+
+def derivative_sizes():
+    return {'thumb': app.config['THUMBNAIL_SIZE'], 'preview': app.config['PREVIEW_SIZE']}
+
+def derivative_key(source_key, name):
+    return f"{DERIVATIVE_PREFIX}{source_key}/{name}.jpg"
+
+def derivative_etag(source_key, name):
+    # Stored objects never change under their key, so renditions only change
+    # with the settings they are rendered with
+    version = f"{derivative_key(source_key, name)}:{derivative_sizes()[name]}:{app.config['DERIVATIVE_QUALITY']}"
+    return hashlib.sha256(version.encode()).hexdigest()[:32]
+
+def rendered_keys(files):
+    """The storage keys among `files` that have thumbnails ready."""
+    keys = {f.s3_key for f in files}
+    if not keys:
+        return set()
+    return {key for (key,) in db.session.query(Derivative.source_key).filter(
+        Derivative.source_key.in_(keys), Derivative.status == 'ready'
+    )}
+
+def render_file_derivatives(file_id):
+    file = db.session.get(File, file_id)
+    # Files sharing a blob share renditions: render each object only once
+    if not file or db.session.get(Derivative, file.s3_key):
+        return
+    source_key, filename = file.s3_key, file.filename
+    max_bytes = app.config['RENDER_MAX_BYTES']
+    status, width, height = 'ready', None, None
+    if not can_render(filename):
+        status = 'unsupported'
+    elif (file.size or 0) > max_bytes:
+        status = 'too_large'
+    else:
+        stream = storage.open(source_key)
+        try:
+            data = stream.read(max_bytes)
+        finally:
+            stream.close()
+        # Release the connection while the pool renders
+        db.session.rollback()
+        try:
+            (width, height), images = render_pool.render(
+                data, filename, derivative_sizes(),
+                quality=app.config['DERIVATIVE_QUALITY'],
+                max_pixels=app.config['RENDER_MAX_PIXELS']
+            )
+        except UnsupportedImage as e:
+            # Retrying cannot help an image we cannot decode
+            logger.warning("Could not render file %s: %s", file_id, e)
+            status = 'failed'
+        else:
+            for name, image in images.items():
+                storage.upload_fileobj(io.BytesIO(image), derivative_key(source_key, name), 'image/jpeg')
+    db.session.add(Derivative(source_key=source_key, status=status, width=width, height=height,
+                              rendered_at=datetime.now(timezone.utc)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A file with the same content was rendered at the same time
+        db.session.rollback()
+
+def release_derivatives(keys):
+    """Drop the renditions of stored objects that are being deleted. Returns
+    the storage keys of the renditions."""
+    if not keys:
+        return []
+    rendered = db.session.execute(delete(Derivative).where(
+        Derivative.source_key.in_(keys)
+    ).returning(Derivative.source_key, Derivative.status)).all()
+    return [derivative_key(key, name) for key, status in rendered if status == 'ready' for name in derivative_sizes()]
+
+# Folders form a tree per owner with a materialized path of ids ("/3/17/42/").
+# Paths only hold digits and "/", so a subtree is the range from its path up
+# to the same path with the trailing "/" replaced by "0" (the next byte): one
+# indexed range scan on (owner_id, path), never a recursive walk.
+def subtree_upper(path):
+    return path[:-1] + '0'
+
+def in_subtree(path):
+    return and_(Folder.path >= path, Folder.path < subtree_upper(path))
+
+def get_owned_folder(folder_id):
+    """The current user's folder with this id, or None for the root. Raises
+    ValueError for ids that are not the user's folders."""
+    if folder_id in (None, '', 'root'):
+        return None
+    try:
+        folder = db.session.get(Folder, int(folder_id))
+    except (TypeError, ValueError):
+        folder = None
+    if not folder or folder.owner_id != session['user_id']:
+        raise ValueError("Folder not found")
+    return folder
+
+def folder_name_taken(owner_id, parent_id, name, exclude_id=None):
+    query = db.session.query(Folder.id).filter(Folder.owner_id == owner_id, Folder.parent_id == parent_id, Folder.name == name)
+    if exclude_id:
+        query = query.filter(Folder.id != exclude_id)
+    return query.first() is not None
+
+def path_ids(path):
+    return [int(i) for i in path.strip('/').split('/')]
+
+def folder_breadcrumbs(folder):
+    if not folder:
+        return []
+    return Folder.query.filter(Folder.id.in_(path_ids(folder.path))).order_by(Folder.depth).all()
+
+def folder_choices(owner_id):
+    """(id, "/a/b") for every folder of the owner, for move targets."""
+    folders = db.session.query(Folder.id, Folder.name, Folder.path).filter(Folder.owner_id == owner_id).all()
+    names = {f.id: f.name for f in folders}
+    labels = [(f.id, '/' + '/'.join(names[i] for i in path_ids(f.path))) for f in folders]
+    return sorted(labels, key=lambda choice: choice[1])
+
+# Usage counters: users carry the bytes and file count of everything they
+# own and folders the totals of their subtree, so usage and quota checks
+# never sum File rows. Counters move with atomic UPDATEs in the same
+# transaction as the rows they describe.
+class QuotaExceeded(Exception):
+    pass
+
+def quota_for(user):
+    """The user's storage limit in bytes, or None when unlimited."""
+    quota = user.quota_bytes if user.quota_bytes is not None else app.config['DEFAULT_QUOTA_BYTES']
+    return quota or None
+
+def check_quota(user, size):
+    """Cheap early check before any bytes are transferred."""
+    quota = quota_for(user)
+    if quota is not None and user.bytes_used + size > quota:
+        raise QuotaExceeded(f"Upload would exceed your storage quota of {quota} bytes")
+
+def adjust_folder_usage(folder_id, size, count):
+    """Add to the counters of a folder and all of its ancestors."""
+    path = db.session.query(Folder.path).filter(Folder.id == folder_id).scalar() if folder_id else None
+    if not path:
+        return
+    db.session.execute(
+        update(Folder).where(Folder.id.in_(path_ids(path)))
+        .values(bytes_used=Folder.bytes_used + size, file_count=Folder.file_count + count)
+    )
+
+def charge_usage(user_id, folder_id, size):
+    """Count a new file against its owner and folders. The quota is checked
+    in the UPDATE itself, so concurrent uploads cannot overshoot it."""
+    size = size or 0
+    user = db.session.get(User, user_id)
+    stmt = update(User).where(User.id == user_id).values(bytes_used=User.bytes_used + size, file_count=User.file_count + 1)
+    quota = quota_for(user)
+    if quota is not None:
+        stmt = stmt.where(User.bytes_used + size <= quota)
+    if not db.session.execute(stmt).rowcount:
+        raise QuotaExceeded(f"Upload would exceed your storage quota of {quota} bytes")
+    adjust_folder_usage(folder_id, size, 1)
+
+def adjust_counters(model, deltas):
+    """Apply {row id: {column: delta}} to many rows in one UPDATE."""
+    deltas = {row_id: changes for row_id, changes in deltas.items() if any(changes.values())}
+    if not deltas:
+        return
+    columns = {column for changes in deltas.values() for column in changes}
+    values = {
+        column: getattr(model, column) + case(
+            {row_id: changes.get(column, 0) for row_id, changes in deltas.items()},
+            value=model.id,
+            else_=0
+        )
+        for column in columns
+    }
+    db.session.execute(update(model).where(model.id.in_(deltas)).values(**values))
+
+def release_usage(files):
+    """Take deleted files off their owners' and folders' counters."""
+    users = defaultdict(lambda: defaultdict(int))
+    folders = defaultdict(lambda: defaultdict(int))
+    for f in files:
+        users[f.owner_id]['bytes_used'] -= f.size or 0
+        users[f.owner_id]['file_count'] -= 1
+        if f.folder_id:
+            folders[f.folder_id]['bytes_used'] -= f.size or 0
+            folders[f.folder_id]['file_count'] -= 1
+    # Every ancestor's subtree totals shrink too
+    subtrees = defaultdict(lambda: defaultdict(int))
+    for folder_id, path in db.session.query(Folder.id, Folder.path).filter(Folder.id.in_(folders)):
+        for ancestor_id in path_ids(path):
+            for column, delta in folders[folder_id].items():
+                subtrees[ancestor_id][column] += delta
+    adjust_counters(User, users)
+    adjust_counters(Folder, subtrees)
+
+def adjust_share_counts(owner_id, recipient_ids, count):
+    db.session.execute(update(User).where(User.id == owner_id).values(shared_by_count=User.shared_by_count + count * len(recipient_ids)))
+    db.session.execute(update(User).where(User.id.in_(recipient_ids)).values(shared_with_count=User.shared_with_count + count))
+
+# Change journal for sync clients. A change to a file is recorded once for
+# every user who sees it, numbered by that user's change_seq. The counter is
+# bumped with an UPDATE, which holds the user's row lock until commit, so a
+# user's events commit in seq order and a cursor never skips one that was
+# still in flight.
+def record_changes(events):
+    """Journal (user_id, file_id, kind) events in the caller's transaction."""
+    if not events:
+        return
+    per_user = Counter(user_id for user_id, _, _ in events)
+    bumped = db.session.execute(
+        update(User).where(User.id.in_(per_user))
+        .values(change_seq=User.change_seq + case(per_user, value=User.id, else_=0))
+        .returning(User.id, User.change_seq),
+        execution_options={'synchronize_session': False}
+    ).all()
+    seq = {user_id: change_seq - per_user[user_id] for user_id, change_seq in bumped}
+    now = datetime.now(timezone.utc)
+    rows = []
+    for user_id, file_id, kind in events:
+        seq[user_id] += 1
+        rows.append({'user_id': user_id, 'seq': seq[user_id], 'file_id': file_id, 'kind': kind, 'created_at': now})
+    db.session.execute(insert(ChangeEvent), rows)
+
+def record_file_changes(files, kind):
+    """Journal a change to `files` for their owners and everyone they are shared with."""
+    db.session.flush()
+    events = [(f.owner_id, f.id, kind) for f in files]
+    if kind != 'insert':
+        recipients = db.session.query(SharedFile.shared_with_id, SharedFile.file_id).filter(
+            SharedFile.file_id.in_([f.id for f in files])
+        )
+        events.extend((user_id, file_id, kind) for user_id, file_id in recipients)
+    record_changes(events)
+
+def record_share_changes(shares, kind):
+    """Journal shares created or revoked, given (file_id, recipient_id,
+    owner_id) tuples: the owner and the recipient both see a change."""
+    record_changes([
+        event for file_id, recipient_id, owner_id in shares
+        for event in ((owner_id, file_id, kind), (recipient_id, file_id, kind))
+    ])
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     user_id = session.get('user_id')
     user = db.session.get(User, user_id)
-    files = File.query.filter_by(owner_id=user.id).all() if user else []
-    shared_files = SharedFile.query.filter_by(shared_with_id=user.id).all() if user else []
+    cursor = request.args.get('cursor')
+    shared_cursor = request.args.get('shared_cursor')
+    try:
+        folder = get_owned_folder(request.args.get('folder'))
+        folder_id = folder.id if folder else None
+        sort, limit = page_params(request.args)
+        files, next_cursor = folder_files_page(user.id, folder_id, sort, cursor, limit) if user else ([], None)
+        shared_files, next_shared_cursor = shared_files_page(user.id, sort, shared_cursor, limit) if user else ([], None)
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    # Query everything before the loop below touches the files, or autoflush
+    # would write the normalized timestamps back
+    subfolders = Folder.query.filter_by(owner_id=user_id, parent_id=folder_id).order_by(Folder.name).all()
+    breadcrumbs = folder_breadcrumbs(folder)
+    choices = folder_choices(user_id)
+    rendered = rendered_keys(files + [shared.file for shared in shared_files])
+    thumbnails = {
+        f.id: (derivative_url(f, 'thumb'), derivative_url(f, 'preview'))
+        for f in files + [shared.file for shared in shared_files] if f.s3_key in rendered
+    }
     recent_threshold = datetime.now(timezone.utc) - timedelta(hours=1)
     # Normalize all file.uploaded_at values to be timezone-aware
     for f in files:
     	if f.uploaded_at and f.uploaded_at.tzinfo is None:
         	f.uploaded_at = f.uploaded_at.replace(tzinfo=timezone.utc)
-    return render_template('dashboard.html', files=files, shared_files=shared_files, user=user, recent_threshold=recent_threshold)
+    return render_template(
+        'dashboard.html',
+        files=files,
+        shared_files=shared_files,
+        folder=folder,
+        breadcrumbs=breadcrumbs,
+        subfolders=subfolders,
+        folder_choices=choices,
+        thumbnails=thumbnails,
+        user=user,
+        recent_threshold=recent_threshold,
+        sort=sort,
+        cursor=cursor,
+        shared_cursor=shared_cursor,
+        next_cursor=next_cursor,
+        next_shared_cursor=next_shared_cursor,
+        direct_uploads=storage.supports_direct_upload
+    )
+
+@app.route('/api/files')
+@login_required
+def api_files():
+    try:
+        sort, limit = page_params(request.args)
+        if 'folder' in request.args:
+            folder = get_owned_folder(request.args['folder'])
+            files, next_cursor = folder_files_page(session['user_id'], folder.id if folder else None, sort, request.args.get('cursor'), limit)
+        else:
+            files, next_cursor = own_files_page(session['user_id'], sort, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'files': [serialize_file(f) for f in files], 'next_cursor': next_cursor})
+
+@app.route('/api/shared')
+@login_required
+def api_shared_files():
+    try:
+        sort, limit = page_params(request.args)
+        shared_files, next_cursor = shared_files_page(session['user_id'], sort, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'files': [serialize_file(s.file) for s in shared_files], 'next_cursor': next_cursor})
+
+# Storage keys never depend on the display name: a file's key is fixed when
+# it is uploaded, so renames and moves are metadata-only. Browsers see the
+# filename through the Content-Disposition of their download links.
+def new_object_key():
+    return f"uploads/{uuid.uuid4().hex}"
+
+# Content-addressed storage: identical content is kept once as a Blob that
+# every File with that SHA-256 references. Blobs are only created from hashes
+# the server computed itself, never from a hash supplied by the client.
+def blob_key(sha256):
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+def acquire_blob(sha256):
+    updated = db.session.execute(
+        update(Blob).where(Blob.sha256 == sha256).values(ref_count=Blob.ref_count + 1)
+    ).rowcount
+    return Blob.query.filter_by(sha256=sha256).first() if updated else None
+
+def attach_blob(sha256, key, size):
+    """Reference the blob for this content, creating it from the object at key
+    if it is new. Returns the blob and whether the object at key is redundant."""
+    blob = acquire_blob(sha256)
+    if not blob:
+        blob = Blob(sha256=sha256, s3_key=key, size=size, ref_count=1, created_at=datetime.now(timezone.utc))
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # A concurrent upload of the same content created it first
+            blob = acquire_blob(sha256)
+    return blob, blob.s3_key != key
+
+def release_blobs(files):
+    """Drop the deleted files' references to their content. Returns the
+    storage keys nothing references any more."""
+    refs = Counter(f.blob_id for f in files if f.blob_id)
+    adjust_counters(Blob, {blob_id: {'ref_count': -count} for blob_id, count in refs.items()})
+    keys = []
+    if refs:
+        # Deleted and returned in one statement, so a concurrent upload that
+        # re-acquires the blob in between keeps it alive
+        keys = db.session.execute(
+            delete(Blob).where(Blob.id.in_(refs), Blob.ref_count <= 0).returning(Blob.s3_key)
+        ).scalars().all()
+    # Older uploads could reuse one name-derived key across several rows
+    legacy_keys = {f.s3_key for f in files if not f.blob_id}
+    if legacy_keys:
+        still_used = {key for (key,) in db.session.query(File.s3_key).filter(File.s3_key.in_(legacy_keys))}
+        keys.extend(sorted(legacy_keys - still_used))
+    return keys
+
+def delete_files(files):
+    """Delete File rows with their shares, usage and content references in a
+    few set-based statements, in the caller's transaction. Content nothing
+    references any more is deleted from storage by a job queued in the same
+    transaction."""
+    if not files:
+        return
+    record_file_changes(files, 'delete')
+    file_ids = [f.id for f in files]
+    shares = db.session.query(SharedFile.shared_with_id, File.owner_id, func.count(SharedFile.id)).join(
+        File, SharedFile.file_id == File.id
+    ).filter(SharedFile.file_id.in_(file_ids)).group_by(SharedFile.shared_with_id, File.owner_id).all()
+    share_counts = defaultdict(lambda: defaultdict(int))
+    for recipient_id, owner_id, count in shares:
+        share_counts[recipient_id]['shared_with_count'] -= count
+        share_counts[owner_id]['shared_by_count'] -= count
+    adjust_counters(User, share_counts)
+    release_usage(files)
+
+    db.session.execute(delete(SharedFile).where(SharedFile.file_id.in_(file_ids)))
+    db.session.execute(delete(Posting).where(Posting.file_id.in_(file_ids)))
+    db.session.execute(delete(FileText).where(FileText.file_id.in_(file_ids)))
+    db.session.execute(update(UploadSession).where(UploadSession.file_id.in_(file_ids)).values(file_id=None))
+    db.session.execute(delete(File).where(File.id.in_(file_ids)), execution_options={'synchronize_session': False})
+    for f in files:
+        db.session.expunge(f)
+    keys = release_blobs(files)
+    queue_storage_deletes(keys + release_derivatives(keys))
+
+def delete_stored_object(key):
+    try:
+        storage.delete(key)
+    except Exception as e:
+        logger.error("Could not delete stored object %s: %s", key, e)
+
+# Background jobs. Work that can wait (storage deletes, content indexing,
+# thumbnails) is queued in the transaction of the change that needs it and
+# runs on worker threads in this process (JOB_INPROCESS_WORKERS) and/or on
+# separate `flask run-jobs` processes, so requests return once metadata is
+# committed.
+job_queue = JobQueue(
+    Job.__table__,
+    lambda: db.engine,
+    lease=app.config['JOB_LEASE'],
+    max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+    backoff_base=app.config['JOB_BACKOFF_BASE'],
+    backoff_max=app.config['JOB_BACKOFF_MAX']
+)
+
+def queue_storage_deletes(keys, delay=0):
+    for start in range(0, len(keys), S3_MAX_DELETE_KEYS):
+        job_queue.enqueue(db.session, 'delete-objects', {'keys': keys[start:start + S3_MAX_DELETE_KEYS]}, delay=delay)
+
+def queue_upload_processing(file):
+    """Queue the content indexing and, for images, the thumbnails of a new upload."""
+    # SQLite can hand a deleted file's id to the next upload, so the keys
+    # also carry the upload time
+    suffix = f"{file.id}:{file.uploaded_at.isoformat()}"
+    job_queue.enqueue(db.session, 'index-content', {'file_id': file.id}, key=f"index-content:{suffix}")
+    if can_render(file.filename):
+        job_queue.enqueue(db.session, 'render-derivatives', {'file_id': file.id}, key=f"render-derivatives:{suffix}")
+
+def run_delete_objects(payload):
+    keys = set(payload['keys'])
+    # Content uploaded again since the job was queued may be stored under the
+    # same key (blob keys derive from the hash), and a direct upload may
+    # have been confirmed; leave those alone
+    in_use = {key for (key,) in db.session.query(Blob.s3_key).filter(Blob.s3_key.in_(keys))}
+    in_use.update(key for (key,) in db.session.query(File.s3_key).filter(File.s3_key.in_(keys)))
+    # Likewise renditions of such content that were rendered again
+    sources = {key: key[len(DERIVATIVE_PREFIX):].rpartition('/')[0] for key in keys if key.startswith(DERIVATIVE_PREFIX)}
+    if sources:
+        rendered = {key for (key,) in db.session.query(Derivative.source_key).filter(Derivative.source_key.in_(set(sources.values())))}
+        in_use.update(key for key, source in sources.items() if source in rendered)
+    failed = storage.delete_many(sorted(keys - in_use))
+    if failed:
+        # Deleting is idempotent, so the retry simply covers the whole batch
+        raise StorageError(f"Could not delete {len(failed)} stored object(s)")
+
+def run_reclaim_upload_session(payload):
+    upload_session = db.session.get(UploadSession, payload['session_id'])
+    if not upload_session or upload_session.status != 'active':
+        return
+    # Abandoned: drop its parts. A session whose parts were assembled but
+    # whose File row never committed is also still active; its object goes
+    # too unless a file references the key by now
+    storage.abort_multipart_upload(upload_session.s3_key, upload_session.upload_id)
+    if db.session.execute(update(UploadSession).where(
+        UploadSession.id == upload_session.id, UploadSession.status == 'active'
+    ).values(status='aborted', updated_at=datetime.now(timezone.utc))).rowcount:
+        queue_storage_deletes([upload_session.s3_key])
+    db.session.commit()
+
+def run_index_content(payload):
+    index_file_content(payload['file_id'])
+
+def run_render_derivatives(payload):
+    render_file_derivatives(payload['file_id'])
+
+job_worker = JobWorker(
+    job_queue,
+    {
+        'delete-objects': run_delete_objects,
+        'reclaim-upload-session': run_reclaim_upload_session,
+        'index-content': run_index_content,
+        'render-derivatives': run_render_derivatives
+    },
+    app.app_context,
+    batch_size=app.config['JOB_BATCH_SIZE'],
+    poll_interval=app.config['JOB_POLL_INTERVAL'],
+    retention=app.config['JOB_RETENTION_DAYS'] * 86400,
+    log=logger
+)
+
+@app.before_request
+def start_job_workers():
+    # Started with the first request rather than at import, so CLI commands
+    # such as `flask db upgrade` never run jobs
+    job_worker.start_threads(app.config['JOB_INPROCESS_WORKERS'])
+
+def discard_written_object(key):
+    """After a rolled-back upload, drop the object it wrote. Another file may
+    reference the key by now (blob keys derive from the hash, and an upload
+    can be confirmed twice); the delete job checks that when it runs."""
+    if not key:
+        return
+    try:
+        queue_storage_deletes([key])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Could not queue delete of stored object %s: %s", key, e)
 
 @app.route('/upload', methods=['POST'])
 @login_required
@@ -161,56 +942,786 @@ def upload():
         return redirect('/dashboard')
 
     filename = secure_filename(file.filename)
-    key = f"{session['username']}/{filename}"
-    file.seek(0, os.SEEK_END)
-    size = file.tell()
-    file.seek(0)
+    try:
+        folder = get_owned_folder(request.form.get('folder_id'))
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    # Hash the spooled upload first so content we already store is never re-sent to S3
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+        digest.update(chunk)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    sha256 = digest.hexdigest()
+    try:
+        check_quota(user, size)
+    except QuotaExceeded as e:
+        flash(str(e), "danger")
+        return redirect('/dashboard')
 
+    written_key = None
     try:
-        s3.upload_fileobj(file, BUCKET, key)
+        redundant_key = None
+        blob = acquire_blob(sha256)
+        if not blob:
+            key = blob_key(sha256)
+            storage.upload_fileobj(file, key, file.mimetype)
+            written_key = key
+            blob, redundant = attach_blob(sha256, key, size)
+            redundant_key = key if redundant else None
         new_file = File(
             filename=filename,
-            s3_key=key,
+            s3_key=blob.s3_key,
+            blob_id=blob.id,
             owner_id=user.id,
+            folder_id=folder.id if folder else None,
             size=size,
+            sha256=sha256,
             uploaded_at=datetime.now(timezone.utc)
         )
         db.session.add(new_file)
+        charge_usage(user.id, new_file.folder_id, size)
+        record_file_changes([new_file], 'insert')
+        queue_upload_processing(new_file)
+        if redundant_key:
+            queue_storage_deletes([redundant_key])
         db.session.commit()
-        logger.info(f"User '{user.username}' uploaded file: {filename} ({size} bytes)")
+        logger.info("User '%s' uploaded file: %s (%s bytes)", user.username, filename, size)
         flash("File uploaded successfully", "success")
+    except QuotaExceeded as e:
+        db.session.rollback()
+        discard_written_object(written_key)
+        flash(str(e), "danger")
     except Exception as e:
-        logger.error(f"File upload failed: {str(e)}")
+        db.session.rollback()
+        discard_written_object(written_key)
+        logger.error("File upload failed: %s", e)
         flash("An error occurred during upload.", "danger")
 
     return redirect('/dashboard')
 
+# Direct-to-S3 uploads: the browser posts the bytes straight to the bucket
+# using a signed policy, then confirms so we can record the File row.
+def upload_signer():
+    return URLSafeTimedSerializer(app.secret_key, salt='direct-upload')
+
+@app.route('/upload-url', methods=['POST'])
+@login_required
+def upload_url():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    content_type = data.get('content_type') or 'application/octet-stream'
+    size = data.get('size')
+    if not filename:
+        return jsonify({'error': 'Missing filename'}), 400
+    if not storage.supports_direct_upload:
+        return jsonify({'error': 'Direct uploads are not supported by this storage backend; use /upload-stream'}), 501
+
+    max_size = app.config['MAX_UPLOAD_SIZE']
+    if not isinstance(size, int) or size < 0 or size > max_size:
+        return jsonify({'error': f'File size must be between 0 and {max_size} bytes'}), 413
+    allowed_types = app.config['ALLOWED_UPLOAD_TYPES']
+    if allowed_types and content_type not in allowed_types:
+        return jsonify({'error': f'Content type {content_type} is not allowed'}), 415
+    try:
+        folder = get_owned_folder(data.get('folder_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    folder_id = folder.id if folder else None
+    try:
+        check_quota(db.session.get(User, session['user_id']), size)
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 413
+
+    sha256 = (data.get('sha256') or '').lower()
+    if sha256:
+        # Re-uploading content this user already stores completes without a
+        # transfer. Other users' blobs are not matched on a client-supplied
+        # hash, as that would hand their content to anyone who knows the hash.
+        owned = File.query.filter(File.owner_id == session['user_id'], File.sha256 == sha256, File.blob_id.isnot(None)).first()
+        blob = acquire_blob(sha256) if owned else None
+        if blob:
+            new_file = File(
+                filename=filename,
+                s3_key=blob.s3_key,
+                blob_id=blob.id,
+                owner_id=session['user_id'],
+                folder_id=folder_id,
+                size=blob.size,
+                sha256=sha256,
+                uploaded_at=datetime.now(timezone.utc)
+            )
+            db.session.add(new_file)
+            try:
+                charge_usage(session['user_id'], folder_id, blob.size)
+                record_file_changes([new_file], 'insert')
+                queue_upload_processing(new_file)
+            except QuotaExceeded as e:
+                db.session.rollback()
+                return jsonify({'error': str(e)}), 413
+            db.session.commit()
+            logger.info("User '%s' uploaded duplicate file: %s (%s bytes)", session['username'], filename, blob.size)
+            return jsonify({'id': new_file.id, 'filename': new_file.filename, 'size': new_file.size, 'duplicate': True})
+
+    key = new_object_key()
+    expiry = app.config['UPLOAD_URL_EXPIRY']
+    try:
+        # The policy only admits the size that passed the quota check
+        post = storage.presigned_post(key, content_type, size, expiry)
+    except Exception as e:
+        logger.error("Error generating upload policy for %s: %s", filename, e)
+        return jsonify({'error': str(e)}), 500
+    # Reclaim the object if the upload is never confirmed: once the token has
+    # expired nothing can claim it, and the job leaves confirmed keys alone
+    queue_storage_deletes([key], delay=expiry * 2 + 60)
+    db.session.commit()
+
+    token = upload_signer().dumps({'key': key, 'filename': filename, 'user_id': session['user_id'], 'folder_id': folder_id})
+    return jsonify({'url': post['url'], 'fields': post['fields'], 'token': token})
+
+@app.route('/upload-complete', methods=['POST'])
+@login_required
+def upload_complete():
+    data = request.get_json(silent=True) or {}
+    try:
+        pending = upload_signer().loads(data.get('token', ''), max_age=app.config['UPLOAD_URL_EXPIRY'] * 2)
+    except BadSignature:
+        return jsonify({'error': 'Invalid or expired upload token'}), 400
+    if pending['user_id'] != session['user_id']:
+        return jsonify({'error': 'Upload token does not belong to this user'}), 403
+
+    try:
+        # Under the user's row lock a retried or replayed confirmation sees
+        # the first one and gets its file instead of a second row
+        db.session.query(User.id).filter(User.id == session['user_id']).with_for_update().first()
+        existing = File.query.filter_by(s3_key=pending['key'], owner_id=session['user_id']).first()
+        if existing:
+            response = jsonify({'id': existing.id, 'filename': existing.filename, 'size': existing.size})
+            db.session.rollback()
+            return response
+        # The folder may have been deleted while the upload was running
+        folder_id = pending.get('folder_id')
+        if folder_id and not db.session.get(Folder, folder_id):
+            folder_id = None
+        # Trust storage for the size rather than the client
+        new_file = File(
+            filename=pending['filename'],
+            s3_key=pending['key'],
+            owner_id=session['user_id'],
+            folder_id=folder_id,
+            size=storage.size(pending['key']),
+            uploaded_at=datetime.now(timezone.utc)
+        )
+        db.session.add(new_file)
+        charge_usage(session['user_id'], folder_id, new_file.size)
+        record_file_changes([new_file], 'insert')
+        queue_upload_processing(new_file)
+        db.session.commit()
+        logger.info("User '%s' uploaded file: %s (%s bytes)", session['username'], new_file.filename, new_file.size)
+        return jsonify({'id': new_file.id, 'filename': new_file.filename, 'size': new_file.size})
+    except QuotaExceeded as e:
+        db.session.rollback()
+        discard_written_object(pending['key'])
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Upload confirmation failed for %s: %s", pending['key'], e)
+        return jsonify({'error': 'Upload could not be confirmed'}), 500
+
+# Resumable multipart uploads: the client uploads parts in parallel to
+# presigned URLs and can pick up an interrupted session where it stopped.
+S3_MAX_PARTS = 10000
+
+def get_upload_session(session_id):
+    upload_session = db.session.get(UploadSession, session_id)
+    if not upload_session or upload_session.owner_id != session['user_id']:
+        return None
+    return upload_session
+
+def list_uploaded_parts(upload_session):
+    return storage.list_parts(upload_session.s3_key, upload_session.upload_id)
+
+def serialize_upload_session(upload_session):
+    return {
+        'id': upload_session.id,
+        'filename': upload_session.filename,
+        'size': upload_session.size,
+        'part_size': upload_session.part_size,
+        'part_count': max(1, math.ceil(upload_session.size / upload_session.part_size)),
+        'status': upload_session.status
+    }
+
+@app.route('/uploads', methods=['GET'])
+@login_required
+def list_upload_sessions():
+    sessions = UploadSession.query.filter_by(owner_id=session['user_id'], status='active').all()
+    return jsonify({'uploads': [serialize_upload_session(s) for s in sessions]})
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    content_type = data.get('content_type') or 'application/octet-stream'
+    size = data.get('size')
+    if not filename:
+        return jsonify({'error': 'Missing filename'}), 400
+    if not storage.supports_direct_upload:
+        return jsonify({'error': 'Direct uploads are not supported by this storage backend; use /upload-stream'}), 501
+
+    max_size = app.config['MULTIPART_MAX_SIZE']
+    if not isinstance(size, int) or size <= 0 or size > max_size:
+        return jsonify({'error': f'File size must be between 1 and {max_size} bytes'}), 413
+    allowed_types = app.config['ALLOWED_UPLOAD_TYPES']
+    if allowed_types and content_type not in allowed_types:
+        return jsonify({'error': f'Content type {content_type} is not allowed'}), 415
+    try:
+        folder = get_owned_folder(data.get('folder_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    try:
+        check_quota(db.session.get(User, session['user_id']), size)
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 413
+
+    # Grow the part size in whole MiB so the file fits in S3's part limit
+    part_size = max(app.config['MULTIPART_PART_SIZE'], math.ceil(size / S3_MAX_PARTS))
+    part_size = math.ceil(part_size / 1024 ** 2) * 1024 ** 2
+    key = new_object_key()
+    try:
+        upload_id = storage.create_multipart_upload(key, content_type)
+        now = datetime.now(timezone.utc)
+        upload_session = UploadSession(
+            upload_id=upload_id,
+            s3_key=key,
+            filename=filename,
+            content_type=content_type,
+            size=size,
+            part_size=part_size,
+            status='active',
+            owner_id=session['user_id'],
+            folder_id=folder.id if folder else None,
+            created_at=now,
+            updated_at=now
+        )
+        db.session.add(upload_session)
+        db.session.flush()
+        # Aborts the upload if it is still open by then
+        job_queue.enqueue(db.session, 'reclaim-upload-session', {'session_id': upload_session.id},
+                          delay=app.config['MULTIPART_SESSION_TTL'])
+        db.session.commit()
+        return jsonify(serialize_upload_session(upload_session)), 201
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Could not start multipart upload for %s: %s", filename, e)
+        return jsonify({'error': 'Could not start upload'}), 500
+
+@app.route('/uploads/<int:session_id>/parts/<int:part_number>', methods=['POST'])
+@login_required
+def presign_upload_part(session_id, part_number):
+    upload_session = get_upload_session(session_id)
+    if not upload_session or upload_session.status != 'active':
+        return jsonify({'error': 'Upload session not found'}), 404
+    if not 1 <= part_number <= serialize_upload_session(upload_session)['part_count']:
+        return jsonify({'error': 'Part number out of range'}), 400
+    try:
+        url = storage.presign_part(upload_session.s3_key, upload_session.upload_id, part_number, app.config['UPLOAD_URL_EXPIRY'])
+        return jsonify({'url': url})
+    except Exception as e:
+        logger.error("Error presigning part %s of upload %s: %s", part_number, session_id, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/uploads/<int:session_id>/parts', methods=['GET'])
+@login_required
+def list_upload_parts(session_id):
+    upload_session = get_upload_session(session_id)
+    if not upload_session or upload_session.status != 'active':
+        return jsonify({'error': 'Upload session not found'}), 404
+    try:
+        parts = list_uploaded_parts(upload_session)
+        return jsonify({'parts': [
+            {'part_number': p['PartNumber'], 'etag': p['ETag'], 'size': p['Size']} for p in parts
+        ]})
+    except Exception as e:
+        logger.error("Error listing parts of upload %s: %s", session_id, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/uploads/<int:session_id>/complete', methods=['POST'])
+@login_required
+def complete_upload_session(session_id):
+    upload_session = get_upload_session(session_id)
+    if not upload_session or upload_session.status != 'active':
+        return jsonify({'error': 'Upload session not found'}), 404
+    assembled = False
+    try:
+        # The storage's own part list is authoritative, so clients never need to read ETags
+        parts = list_uploaded_parts(upload_session)
+        uploaded = sum(p['Size'] for p in parts)
+        if uploaded != upload_session.size:
+            return jsonify({'error': f'Uploaded {uploaded} of {upload_session.size} bytes'}), 409
+
+        new_file = File(
+            filename=upload_session.filename,
+            s3_key=upload_session.s3_key,
+            owner_id=upload_session.owner_id,
+            folder_id=upload_session.folder_id,
+            size=upload_session.size,
+            uploaded_at=datetime.now(timezone.utc)
+        )
+        db.session.add(new_file)
+        # Charged before the parts are assembled: over quota, the session
+        # stays resumable until the user frees space or aborts it
+        charge_usage(upload_session.owner_id, upload_session.folder_id, upload_session.size)
+        storage.complete_multipart_upload(upload_session.s3_key, upload_session.upload_id, parts)
+        assembled = True
+        db.session.flush()
+        upload_session.file_id = new_file.id
+        upload_session.status = 'completed'
+        upload_session.updated_at = datetime.now(timezone.utc)
+        record_file_changes([new_file], 'insert')
+        queue_upload_processing(new_file)
+        db.session.commit()
+        logger.info("User '%s' uploaded file: %s (%s bytes, %s parts)", session['username'], new_file.filename, new_file.size, len(parts))
+        return jsonify({'id': new_file.id, 'filename': new_file.filename, 'size': new_file.size})
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Completing upload %s failed: %s", session_id, e)
+        if assembled:
+            # The parts are gone, so the session cannot be retried; if this
+            # fails too, the session's reclaim job deletes the object
+            upload_session.status = 'aborted'
+            upload_session.updated_at = datetime.now(timezone.utc)
+            discard_written_object(upload_session.s3_key)
+        return jsonify({'error': 'Upload could not be completed'}), 500
+
+@app.route('/uploads/<int:session_id>', methods=['DELETE'])
+@login_required
+def abort_upload_session(session_id):
+    upload_session = get_upload_session(session_id)
+    if not upload_session or upload_session.status != 'active':
+        return jsonify({'error': 'Upload session not found'}), 404
+    try:
+        storage.abort_multipart_upload(upload_session.s3_key, upload_session.upload_id)
+        upload_session.status = 'aborted'
+        upload_session.updated_at = datetime.now(timezone.utc)
+        db.session.commit()
+        return jsonify({'id': upload_session.id, 'status': upload_session.status})
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Aborting upload %s failed: %s", session_id, e)
+        return jsonify({'error': 'Upload could not be aborted'}), 500
+
+# Streaming uploads: the raw request body is read in fixed-size chunks and
+# each chunk becomes an S3 part, so memory use is bounded by the chunk size.
+def read_chunk(stream, size):
+    buf = bytearray()
+    while len(buf) < size:
+        data = stream.read(size - len(buf))
+        if not data:
+            break
+        buf += data
+    return bytes(buf)
+
+@app.route('/upload-stream', methods=['PUT', 'POST'])
+@login_required
+def upload_stream():
+    filename = secure_filename(request.args.get('filename') or request.headers.get('X-Filename') or '')
+    if not filename:
+        return jsonify({'error': 'Missing filename'}), 400
+    content_type = request.mimetype or 'application/octet-stream'
+    allowed_types = app.config['ALLOWED_UPLOAD_TYPES']
+    if allowed_types and content_type not in allowed_types:
+        return jsonify({'error': f'Content type {content_type} is not allowed'}), 415
+    max_size = app.config['MULTIPART_MAX_SIZE']
+    if request.content_length is not None and request.content_length > max_size:
+        return jsonify({'error': f'File exceeds {max_size} bytes'}), 413
+    try:
+        folder = get_owned_folder(request.args.get('folder_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    user = db.session.get(User, session['user_id'])
+    try:
+        check_quota(user, request.content_length or 0)
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 413
+    # Bodies without a Content-Length are cut off once they pass the quota
+    quota = quota_for(user)
+    remaining = quota - user.bytes_used if quota is not None else None
+
+    # The hash is only known at the end, so stream to a unique key that
+    # becomes the blob's home if this content is new
+    key = new_object_key()
+    chunk_size = app.config['UPLOAD_STREAM_CHUNK_SIZE']
+    digest = hashlib.sha256()
+    size = 0
+    writer = storage.open_writer(key, content_type)
+    try:
+        # request.stream bypasses Werkzeug's form parser, so nothing is spooled
+        stream = request.stream
+        chunk = read_chunk(stream, chunk_size)
+        while chunk:
+            digest.update(chunk)
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError(f"File exceeds {max_size} bytes")
+            if remaining is not None and size > remaining:
+                raise QuotaExceeded(f"Upload would exceed your storage quota of {quota} bytes")
+            writer.write(chunk)
+            chunk = read_chunk(stream, chunk_size)
+        writer.commit()
+        writer = None
+
+        sha256 = digest.hexdigest()
+        blob, redundant = attach_blob(sha256, key, size)
+        new_file = File(
+            filename=filename,
+            s3_key=blob.s3_key,
+            blob_id=blob.id,
+            owner_id=session['user_id'],
+            folder_id=folder.id if folder else None,
+            size=size,
+            sha256=sha256,
+            uploaded_at=datetime.now(timezone.utc)
+        )
+        db.session.add(new_file)
+        charge_usage(user.id, new_file.folder_id, size)
+        record_file_changes([new_file], 'insert')
+        queue_upload_processing(new_file)
+        if redundant:
+            queue_storage_deletes([key])
+        db.session.commit()
+        logger.info("User '%s' streamed file: %s (%s bytes)", session['username'], filename, size)
+        return jsonify({'id': new_file.id, 'filename': new_file.filename, 'size': size, 'sha256': new_file.sha256}), 201
+    except Exception as e:
+        db.session.rollback()
+        if writer is not None:
+            try:
+                writer.abort()
+            except Exception as abort_error:
+                logger.error("Aborting streamed upload %s failed: %s", key, abort_error)
+        elif isinstance(e, QuotaExceeded):
+            # Stored under a key nothing else uses
+            delete_stored_object(key)
+        if isinstance(e, QuotaExceeded):
+            return jsonify({'error': str(e)}), 413
+        logger.error("Streaming upload failed: %s", e)
+        return jsonify({'error': 'Upload failed'}), 500
+
+# Download URLs are cached per (key, filename, expiry bucket). A URL signed at any
+# point in a bucket stays valid for at least TTL - REFRESH seconds after the
+# bucket closes, so cached links are never handed out close to expiry.
+url_cache = {}
+url_cache_lock = threading.Lock()
+url_cache_bucket = None
+
+def presigned_get_url(key, filename=None):
+    global url_cache_bucket
+    bucket = int(time.time() // app.config['PRESIGNED_URL_REFRESH'])
+    url = url_cache.get((key, filename, bucket))
+    if url:
+        return url
+    url = storage.download_url(key, app.config['PRESIGNED_URL_TTL'], filename)
+    with url_cache_lock:
+        # Entries from earlier buckets are never read again
+        if bucket != url_cache_bucket or len(url_cache) >= app.config['PRESIGNED_URL_CACHE_SIZE']:
+            url_cache.clear()
+            url_cache_bucket = bucket
+        url_cache[(key, filename, bucket)] = url
+    return url
+
+@app.route('/local-files/<token>')
+def local_file(token):
+    # Download links for LocalStorage; the signed token is the authorisation,
+    # just like a presigned S3 URL
+    if not isinstance(storage, LocalStorage):
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        path, filename = storage.resolve_token(token)
+    except StorageError as e:
+        return jsonify({'error': str(e)}), 404
+    content_type = mimetypes.guess_type(filename or '')[0] or 'application/octet-stream'
+    # Same rule as /download: nothing that could script our origin is inline
+    response = send_file(path, mimetype=content_type, download_name=filename,
+                         as_attachment=not safe_inline(content_type), max_age=0)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    return response
+
+# Downloads through the app, for clients that cannot reach the storage
+# backend. A requested range is fetched as a range from the backend, so
+# seeking in a video or a download manager fetching parts in parallel only
+# moves the bytes asked for, DOWNLOAD_CHUNK_SIZE at a time.
+# Only types a browser displays without running anything are shown inline;
+# HTML, SVG and the like could script our origin
+INLINE_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'text/plain', 'application/pdf'}
+INLINE_TYPE_PREFIXES = ('video/', 'audio/')
+
+def safe_inline(content_type):
+    return content_type in INLINE_TYPES or content_type.startswith(INLINE_TYPE_PREFIXES)
+
+def quote_header(value):
+    value = ''.join(ch for ch in value if ch.isprintable())
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def content_disposition(disposition, filename):
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode()
+        return f"{disposition}; filename=\"{quote_header(fallback)}\"; filename*=UTF-8''{quote(filename, safe='')}"
+    return f'{disposition}; filename="{quote_header(filename)}"'
+
+def download_etag(file):
+    # Content never changes under a file's key
+    return file.sha256 or hashlib.sha256(f"{file.s3_key}:{file.size}".encode()).hexdigest()[:32]
+
+def if_range_matches(etag, last_modified):
+    """Whether a Range request may be answered with part of the current
+    content; an If-Range for any other version gets the whole file."""
+    header = request.headers.get('If-Range')
+    if not header:
+        return True
+    if_range = request.if_range
+    if if_range.etag:
+        # Strong comparison only
+        return not header.startswith('W/') and if_range.etag == etag
+    return last_modified is not None and if_range.date is not None and last_modified.replace(microsecond=0) <= if_range.date
+
+def requested_range(length):
+    """(start, stop) of the byte range requested, or None for the whole
+    content. Raises ValueError for a range past the end."""
+    byte_ranges = request.range
+    # Several ranges would need a multipart/byteranges body; the whole
+    # content is an allowed answer instead
+    if byte_ranges is None or byte_ranges.units != 'bytes' or len(byte_ranges.ranges) != 1:
+        return None
+    start, stop = byte_ranges.ranges[0]
+    if start < 0:
+        # The last -start bytes
+        start = max(0, length + start)
+    stop = length if stop is None else min(stop, length)
+    if start >= stop:
+        raise ValueError("Requested range not satisfiable")
+    return start, stop
+
+def stream_content(stream, length, chunk_size):
+    try:
+        while length > 0:
+            chunk = stream.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        # Also reached when the client disconnects and the server closes us
+        stream.close()
+
+@app.route('/download/<int:file_id>')
+@login_required
+def download(file_id):
+    file = db.session.get(File, file_id)
+    if not file or not can_access(file):
+        return jsonify({'error': 'File not found'}), 404
+    content_type = mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+    # Anything a browser could run on our origin (HTML, SVG, ...) is only
+    # ever offered as an attachment
+    inline = safe_inline(content_type) and not request.args.get('download')
+    etag = download_etag(file)
+    last_modified = file.uploaded_at
+    if last_modified and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    headers = {
+        'Content-Disposition': content_disposition('inline' if inline else 'attachment', file.filename),
+        'ETag': f'"{etag}"',
+        'Cache-Control': 'private, no-cache',
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Security-Policy': 'sandbox'
+    }
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+
+    offload = app.config['DOWNLOAD_OFFLOAD']
+    if offload and isinstance(storage, LocalStorage):
+        # The web server sends the file, ranges and all
+        path = storage.path(file.s3_key)
+        if not os.path.exists(path):
+            return jsonify({'error': 'File content not found'}), 404
+        if offload == 'x-accel-redirect':
+            headers['X-Accel-Redirect'] = app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + os.path.relpath(path, storage.root)
+        else:
+            headers['X-Sendfile'] = path
+        return Response(status=200, mimetype=content_type, headers=headers)
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    try:
+        length = file.size if file.size is not None else storage.size(file.s3_key)
+        span = requested_range(length) if if_range_matches(etag, last_modified) else None
+    except ValueError:
+        return Response(status=416, headers={'Content-Range': f"bytes */{length}"})
+    except Exception as e:
+        logger.error("Could not read file %s: %s", file_id, e)
+        return jsonify({'error': 'File content not found'}), 404
+    start, stop = span or (0, length)
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Content-Length'] = str(stop - start)
+    if span:
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+    body = ()
+    if request.method != 'HEAD' and stop > start:
+        try:
+            stream = storage.open(file.s3_key, start, stop - start)
+        except Exception as e:
+            logger.error("Could not read file %s: %s", file_id, e)
+            return jsonify({'error': 'File content not found'}), 404
+        body = stream_content(stream, stop - start, app.config['DOWNLOAD_CHUNK_SIZE'])
+    return Response(body, status=206 if span else 200, mimetype=content_type, headers=headers, direct_passthrough=True)
+
+def accessible_files_query(user_id):
+    shared_ids = db.session.query(SharedFile.file_id).filter(SharedFile.shared_with_id == user_id)
+    return File.query.filter(or_(File.owner_id == user_id, File.id.in_(shared_ids)))
+
+def can_access(file):
+    if file.owner_id == session['user_id']:
+        return True
+    return SharedFile.query.filter_by(file_id=file.id, shared_with_id=session['user_id']).first() is not None
+
+def derivative_url(file, name):
+    # The version parameter changes with the content, so the browser can
+    # keep each URL for good
+    return url_for('file_derivative', file_id=file.id, name=name, v=derivative_etag(file.s3_key, name)[:12])
+
+@app.route('/files/<int:file_id>/<any(thumb, preview):name>.jpg')
+@login_required
+def file_derivative(file_id, name):
+    file = db.session.get(File, file_id)
+    if not file or not can_access(file):
+        return jsonify({'error': 'File not found'}), 404
+    derivative = db.session.get(Derivative, file.s3_key)
+    if not derivative or derivative.status != 'ready':
+        return jsonify({'error': 'No preview available'}), 404
+    etag = derivative_etag(file.s3_key, name)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': DERIVATIVE_CACHE_CONTROL}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    try:
+        stream = storage.open(derivative_key(file.s3_key, name))
+        try:
+            data = stream.read()
+        finally:
+            stream.close()
+    except Exception as e:
+        logger.error("Could not read %s of file %s: %s", name, file_id, e)
+        return jsonify({'error': 'No preview available'}), 404
+    return Response(data, mimetype='image/jpeg', headers=headers)
+
 @app.route('/generate-link', methods=['POST'])
 @login_required
 def generate_link():
     filename = request.form['filename']
     prefix = request.form.get('prefix', session['username'])
-    key = f"{prefix}/{filename}"
+    # Deduplicated files live under their content hash, so look up the real key
+    file = File.query.join(User, File.owner_id == User.id).filter(User.username == prefix, File.filename == filename).first()
+    if not file or not can_access(file):
+        return jsonify({'error': 'File not found'}), 404
     try:
-        url = s3.generate_presigned_url('get_object', Params={'Bucket': BUCKET, 'Key': key}, ExpiresIn=3600)
+        url = presigned_get_url(file.s3_key, file.filename)
         return jsonify({'url': url})
     except Exception as e:
-        logger.error(f"Error generating link for {filename}: {str(e)}")
+        logger.error("Error generating link for %s: %s", filename, e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/generate-links', methods=['POST'])
+@login_required
+def generate_links():
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('file_ids')
+    if not isinstance(file_ids, list) or not all(isinstance(i, int) for i in file_ids):
+        return jsonify({'error': 'file_ids must be a list of integers'}), 400
+    if len(file_ids) > app.config['MAX_BATCH_LINKS']:
+        return jsonify({'error': f"At most {app.config['MAX_BATCH_LINKS']} links per request"}), 413
+
+    files = accessible_files_query(session['user_id']).filter(File.id.in_(file_ids)).all() if file_ids else []
+    try:
+        urls = {str(f.id): presigned_get_url(f.s3_key, f.filename) for f in files}
+    except Exception as e:
+        logger.error("Error generating batch links: %s", e)
+        return jsonify({'error': str(e)}), 500
+    missing = [i for i in file_ids if str(i) not in urls]
+    return jsonify({'urls': urls, 'missing': missing, 'expires_in': app.config['PRESIGNED_URL_TTL'] - app.config['PRESIGNED_URL_REFRESH']})
+
+# Bulk downloads stream a ZIP built on the fly from storage: no temp files,
+# and memory stays bounded by the prefetch window however large the set.
+def zip_response(files, names, archive_name):
+    entries = [
+        ZipEntry(name, f.s3_key, f.size, f.uploaded_at.timetuple()[:6] if f.uploaded_at else None)
+        for f, name in zip(files, unique_names(names))
+    ]
+    body = stream_zip(
+        entries,
+        storage.open,
+        prefetch=app.config['ZIP_PREFETCH_FILES'],
+        chunk_size=app.config['ZIP_CHUNK_SIZE']
+    )
+    logger.info("User '%s' downloading %s file(s) as %s", session['username'], len(entries), archive_name)
+    return Response(
+        body,
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{archive_name}"'},
+        direct_passthrough=True
+    )
+
+@app.route('/download-zip', methods=['POST'])
+@login_required
+def download_zip():
+    file_ids = request.form.getlist('file_ids', type=int)
+    if not file_ids:
+        flash("Select at least one file to download.", "warning")
+        return redirect('/dashboard')
+    if len(file_ids) > app.config['ZIP_MAX_FILES']:
+        flash(f"At most {app.config['ZIP_MAX_FILES']} files per download.", "warning")
+        return redirect('/dashboard')
+    files = accessible_files_query(session['user_id']).filter(File.id.in_(file_ids)).order_by(File.filename).all()
+    if not files:
+        flash("No files to download.", "warning")
+        return redirect('/dashboard')
+    return zip_response(files, [f.filename for f in files], 'files.zip')
+
+@app.route('/folders/<int:folder_id>/download')
+@login_required
+def download_folder(folder_id):
+    try:
+        folder = get_owned_folder(folder_id)
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    if folder.file_count > app.config['ZIP_MAX_FILES']:
+        flash(f"At most {app.config['ZIP_MAX_FILES']} files per download.", "warning")
+        return redirect(url_for('dashboard', folder=folder.parent_id))
+    # The subtree's folders and files are two range queries on the path
+    folders = Folder.query.filter(Folder.owner_id == folder.owner_id, in_subtree(folder.path)).all()
+    names = {f.id: f.name for f in folders}
+    files = File.query.filter(File.owner_id == folder.owner_id, File.folder_id.in_(names)).order_by(File.folder_id, File.filename).all()
+    paths = {f.id: '/'.join(names[i] for i in path_ids(f.path)[folder.depth:]) for f in folders}
+    return zip_response(files, [f"{paths[f.folder_id]}/{f.filename}" for f in files], f"{folder.name}.zip")
+
 @app.route('/delete/<int:file_id>')
 @login_required
 def delete_file(file_id):
     file = db.session.get(File, file_id)
     if file and file.owner_id == session['user_id']:
         try:
-            s3.delete_object(Bucket=BUCKET, Key=file.s3_key)
-            db.session.delete(file)
+            # Shared content is only removed from storage with its last reference
+            delete_files([file])
             db.session.commit()
             flash("File deleted.", "success")
         except Exception as e:
             db.session.rollback()
-            logger.error(f"File deletion failed: {str(e)}")
+            logger.error("File deletion failed: %s", e)
             flash("Could not delete file.", "danger")
     return redirect('/dashboard')
 
@@ -221,19 +1732,142 @@ def rename():
     new_name = secure_filename(request.form.get('new_name'))
     file = db.session.get(File, int(file_id))
     if file and file.owner_id == session['user_id']:
-        new_key = f"{session['username']}/{new_name}"
-        try:
-            s3.copy_object(Bucket=BUCKET, CopySource={"Bucket": BUCKET, "Key": file.s3_key}, Key=new_key)
-            s3.delete_object(Bucket=BUCKET, Key=file.s3_key)
-            file.filename = new_name
-            file.s3_key = new_key
-            db.session.commit()
-            flash("File renamed.", "success")
-        except Exception as e:
-            logger.error(f"Rename failed: {str(e)}")
-            flash("Rename failed.", "danger")
+        # Keys are independent of the name, so this never touches storage
+        file.filename = new_name
+        record_file_changes([file], 'rename')
+        db.session.commit()
+        flash("File renamed.", "success")
     return redirect('/dashboard')
 
+@app.route('/move-file', methods=['POST'])
+@login_required
+def move_file():
+    file = db.session.get(File, request.form.get('file_id', type=int) or 0)
+    if not file or file.owner_id != session['user_id']:
+        flash("File not found.", "warning")
+        return redirect('/dashboard')
+    source_id = file.folder_id
+    try:
+        target = get_owned_folder(request.form.get('folder_id'))
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect(url_for('dashboard', folder=source_id))
+    target_id = target.id if target else None
+    if target_id != source_id:
+        adjust_folder_usage(source_id, -(file.size or 0), -1)
+        adjust_folder_usage(target_id, file.size or 0, 1)
+        file.folder_id = target_id
+        record_file_changes([file], 'move')
+        db.session.commit()
+    flash("File moved.", "success")
+    return redirect(url_for('dashboard', folder=source_id))
+
+@app.route('/folders', methods=['POST'])
+@login_required
+def create_folder():
+    name = secure_filename(request.form.get('name') or '')
+    try:
+        parent = get_owned_folder(request.form.get('parent_id'))
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    parent_id = parent.id if parent else None
+    if not name:
+        flash("Folder name is required.", "warning")
+    elif folder_name_taken(session['user_id'], parent_id, name):
+        flash("A folder with that name already exists here.", "warning")
+    else:
+        folder = Folder(
+            name=name,
+            path='',
+            depth=parent.depth + 1 if parent else 0,
+            parent_id=parent_id,
+            owner_id=session['user_id'],
+            created_at=datetime.now(timezone.utc)
+        )
+        db.session.add(folder)
+        db.session.flush()
+        folder.path = f"{parent.path if parent else '/'}{folder.id}/"
+        db.session.commit()
+        flash("Folder created.", "success")
+    return redirect(url_for('dashboard', folder=parent_id))
+
+@app.route('/folders/<int:folder_id>/rename', methods=['POST'])
+@login_required
+def rename_folder(folder_id):
+    try:
+        folder = get_owned_folder(folder_id)
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    new_name = secure_filename(request.form.get('new_name') or '')
+    if not new_name:
+        flash("Folder name is required.", "warning")
+    elif folder_name_taken(folder.owner_id, folder.parent_id, new_name, exclude_id=folder.id):
+        flash("A folder with that name already exists here.", "warning")
+    else:
+        # Paths hold ids, not names, so nothing below this folder changes
+        folder.name = new_name
+        db.session.commit()
+        flash("Folder renamed.", "success")
+    return redirect(url_for('dashboard', folder=folder.parent_id))
+
+@app.route('/folders/<int:folder_id>/move', methods=['POST'])
+@login_required
+def move_folder(folder_id):
+    try:
+        folder = get_owned_folder(folder_id)
+        target = get_owned_folder(request.form.get('parent_id'))
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    source_parent_id = folder.parent_id
+    target_id = target.id if target else None
+    if target and target.path.startswith(folder.path):
+        flash("A folder cannot be moved into itself.", "warning")
+    elif folder_name_taken(folder.owner_id, target_id, folder.name, exclude_id=folder.id):
+        flash("A folder with that name already exists there.", "warning")
+    else:
+        old_path = folder.path
+        new_path = f"{target.path if target else '/'}{folder.id}/"
+        depth_change = (target.depth + 1 if target else 0) - folder.depth
+        # The subtree's totals leave the old ancestors and join the new ones
+        adjust_folder_usage(source_parent_id, -folder.bytes_used, -folder.file_count)
+        adjust_folder_usage(target_id, folder.bytes_used, folder.file_count)
+        # One statement re-roots the whole subtree however large it is; files
+        # point at folder ids and stay where they are
+        db.session.execute(
+            update(Folder)
+            .where(Folder.owner_id == folder.owner_id, in_subtree(old_path))
+            .values(path=literal(new_path).concat(func.substr(Folder.path, len(old_path) + 1)), depth=Folder.depth + depth_change),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.execute(update(Folder).where(Folder.id == folder.id).values(parent_id=target_id))
+        db.session.commit()
+        flash("Folder moved.", "success")
+    return redirect(url_for('dashboard', folder=source_parent_id))
+
+@app.route('/folders/<int:folder_id>/delete', methods=['POST'])
+@login_required
+def delete_folder(folder_id):
+    try:
+        folder = get_owned_folder(folder_id)
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect('/dashboard')
+    parent_id = folder.parent_id
+    has_subfolders = db.session.query(Folder.id).filter(Folder.parent_id == folder.id).first() is not None
+    has_files = db.session.query(File.id).filter(File.folder_id == folder.id).first() is not None
+    if has_subfolders or has_files:
+        flash("Only empty folders can be deleted.", "warning")
+    else:
+        # Unfinished uploads aimed at this folder land in the root instead
+        db.session.execute(update(UploadSession).where(UploadSession.folder_id == folder.id).values(folder_id=None))
+        db.session.delete(folder)
+        db.session.commit()
+        flash("Folder deleted.", "success")
+    return redirect(url_for('dashboard', folder=parent_id))
+
 @app.route('/share', methods=['POST'])
 @login_required
 def share():
@@ -242,10 +1876,16 @@ def share():
     file = File.query.filter_by(filename=filename, owner_id=session['user_id']).first()
     recipient = User.query.filter(or_(User.username == recipient_input.lower(), User.email == recipient_input)).first()
     if file and recipient:
-        shared = SharedFile(file_id=file.id, shared_with_id=recipient.id)
-        db.session.add(shared)
-        db.session.commit()
-        flash("File shared successfully.", "success")
+        try:
+            db.session.add(SharedFile(file_id=file.id, shared_with_id=recipient.id))
+            db.session.flush()
+            adjust_share_counts(file.owner_id, [recipient.id], 1)
+            record_share_changes([(file.id, recipient.id, file.owner_id)], 'share')
+            db.session.commit()
+            flash("File shared successfully.", "success")
+        except IntegrityError:
+            db.session.rollback()
+            flash("File is already shared with this user.", "info")
     else:
         flash("Sharing failed. Check file and recipient.", "danger")
     return redirect('/dashboard')
@@ -255,6 +1895,8 @@ def share():
 def revoke(file_id, user_id):
     shared = SharedFile.query.filter_by(file_id=file_id, shared_with_id=user_id).first()
     if shared:
+        adjust_share_counts(shared.file.owner_id, [shared.shared_with_id], -1)
+        record_share_changes([(shared.file_id, shared.shared_with_id, shared.file.owner_id)], 'revoke')
         db.session.delete(shared)
         db.session.commit()
         flash("Access revoked.", "success")
@@ -262,21 +1904,580 @@ def revoke(file_id, user_id):
         flash("Revoke failed.", "danger")
     return redirect('/dashboard')
 
+# Bulk operations: one request, one transaction and set-based statements for
+# any number of files, with storage deletes batched after the commit.
+def bulk_file_ids(data):
+    file_ids = data.get('file_ids')
+    if not isinstance(file_ids, list) or not file_ids or not all(isinstance(i, int) for i in file_ids):
+        raise ValueError('file_ids must be a non-empty list of integers')
+    if len(file_ids) > app.config['MAX_BULK_FILES']:
+        raise ValueError(f"At most {app.config['MAX_BULK_FILES']} files per request")
+    return list(dict.fromkeys(file_ids))
+
+def bulk_recipients(data):
+    names = data.get('recipients')
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise ValueError('recipients must be a list of usernames or emails')
+    lowered = [n.lower() for n in names]
+    users = User.query.filter(or_(User.username.in_(lowered), User.email.in_(names))).all() if names else []
+    found = {u.username for u in users} | {u.email for u in users}
+    unknown = [n for n in names if n.lower() not in found and n not in found]
+    return users, unknown
+
+@app.route('/api/files/delete', methods=['POST'])
+@login_required
+def bulk_delete():
+    try:
+        file_ids = bulk_file_ids(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    files = File.query.filter(File.owner_id == session['user_id'], File.id.in_(file_ids)).all()
+    try:
+        delete_files(files)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Bulk deletion failed: %s", e)
+        return jsonify({'error': 'Could not delete files'}), 500
+    deleted = {f.id for f in files}
+    logger.info("User '%s' deleted %s file(s)", session['username'], len(deleted))
+    return jsonify({'deleted': len(deleted), 'missing': [i for i in file_ids if i not in deleted]})
+
+@app.route('/api/files/share', methods=['POST'])
+@login_required
+def bulk_share():
+    data = request.get_json(silent=True) or {}
+    try:
+        file_ids = bulk_file_ids(data)
+        recipients, unknown = bulk_recipients(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    recipients = [r for r in recipients if r.id != session['user_id']]
+    owned_ids = [file_id for (file_id,) in db.session.query(File.id).filter(File.owner_id == session['user_id'], File.id.in_(file_ids))]
+    recipient_ids = [r.id for r in recipients]
+    if not owned_ids or not recipient_ids:
+        return jsonify({'shared': 0, 'already_shared': 0, 'unknown_recipients': unknown,
+                        'missing': [i for i in file_ids if i not in owned_ids]})
+
+    existing = set(db.session.query(SharedFile.file_id, SharedFile.shared_with_id).filter(
+        SharedFile.file_id.in_(owned_ids), SharedFile.shared_with_id.in_(recipient_ids)
+    ))
+    rows = [
+        {'file_id': file_id, 'shared_with_id': recipient_id}
+        for file_id in owned_ids for recipient_id in recipient_ids
+        if (file_id, recipient_id) not in existing
+    ]
+    try:
+        if rows:
+            db.session.execute(insert(SharedFile), rows)
+            counts = defaultdict(lambda: defaultdict(int))
+            counts[session['user_id']]['shared_by_count'] += len(rows)
+            for row in rows:
+                counts[row['shared_with_id']]['shared_with_count'] += 1
+            adjust_counters(User, counts)
+            record_share_changes([(row['file_id'], row['shared_with_id'], session['user_id']) for row in rows], 'share')
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request shared some of the same pairs; nothing was written
+        db.session.rollback()
+        return jsonify({'error': 'Some files were shared concurrently; retry the request'}), 409
+    logger.info("User '%s' created %s share(s)", session['username'], len(rows))
+    return jsonify({
+        'shared': len(rows),
+        'already_shared': len(existing),
+        'unknown_recipients': unknown,
+        'missing': [i for i in file_ids if i not in owned_ids]
+    })
+
+@app.route('/api/files/revoke', methods=['POST'])
+@login_required
+def bulk_revoke():
+    """Revoke shares of the listed files: the owner's shares with the listed
+    recipients (all recipients if the key is left out; none for an empty
+    list), and shares with the current user, who can always drop files
+    shared with them."""
+    data = request.get_json(silent=True) or {}
+    try:
+        file_ids = bulk_file_ids(data)
+        recipients, unknown = bulk_recipients(data) if 'recipients' in data else (None, [])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    as_owner = File.owner_id == session['user_id']
+    if recipients is not None:
+        as_owner = and_(as_owner, SharedFile.shared_with_id.in_([r.id for r in recipients]))
+    as_recipient = SharedFile.shared_with_id == session['user_id']
+    shares = db.session.query(SharedFile.id, SharedFile.file_id, SharedFile.shared_with_id, File.owner_id).join(
+        File, SharedFile.file_id == File.id
+    ).filter(SharedFile.file_id.in_(file_ids), or_(as_owner, as_recipient)).all()
+    if shares:
+        counts = defaultdict(lambda: defaultdict(int))
+        for _, _, recipient_id, owner_id in shares:
+            counts[recipient_id]['shared_with_count'] -= 1
+            counts[owner_id]['shared_by_count'] -= 1
+        adjust_counters(User, counts)
+        record_share_changes([(file_id, recipient_id, owner_id) for _, file_id, recipient_id, owner_id in shares], 'revoke')
+        db.session.execute(delete(SharedFile).where(SharedFile.id.in_([share_id for share_id, _, _, _ in shares])))
+        db.session.commit()
+    logger.info("User '%s' revoked %s share(s)", session['username'], len(shares))
+    return jsonify({'revoked': len(shares), 'unknown_recipients': unknown})
+
 @app.route('/profile')
 @login_required
 def profile():
     user = db.session.get(User, session['user_id'])
-    shared_with_me = SharedFile.query.filter_by(shared_with_id=user.id).all()
-    shared_by_user = SharedFile.query.join(File).filter(File.owner_id == user.id).all()
-
+    # Totals come from the user's counters, not from counting rows
     return render_template(
         'profile.html',
         user=user,
-        shared_with_me=shared_with_me,
-        shared_by_user=shared_by_user
+        upload_count=user.file_count,
+        shared_with_me_count=user.shared_with_count,
+        shared_by_user_count=user.shared_by_count,
+        bytes_used=user.bytes_used,
+        quota_bytes=quota_for(user)
     )
 
 
+# Versioned JSON API. Responses carry strong ETags derived from row versions
+# (and share ids where shares are part of the representation), so polling
+# clients get 304 Not Modified for unchanged data, and If-Match guards
+# updates against lost writes.
+API_FILE_FIELDS = ('id', 'filename', 'size', 'sha256', 'uploaded_at', 'folder_id', 'owner', 'version', 'shares')
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session or session.get('expires_at', 0) <= time.time():
+            return jsonify({'error': 'Authentication required'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def api_fields(args):
+    """The fields requested with ?fields=a,b, or None for all of them."""
+    if not args.get('fields'):
+        return None
+    fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+    unknown = [f for f in fields if f not in API_FILE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def api_file(file, fields=None, shares=None):
+    data = serialize_file(file)
+    data.update(sha256=file.sha256, version=file.version)
+    if shares is not None:
+        data['shares'] = [{'id': s.id, 'recipient': s.recipient.username} for s in shares]
+    if fields:
+        data = {k: v for k, v in data.items() if k in fields}
+    return data
+
+def api_etag(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+
+def file_etag(file, shares):
+    return api_etag(file.id, file.version, sorted(s.id for s in shares))
+
+def conditional_json(payload, etag, status=200):
+    response = jsonify(payload)
+    response.status_code = status
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def api_owned_file(file_id):
+    file = db.session.get(File, file_id)
+    if not file or file.owner_id != session['user_id']:
+        return None, None
+    return file, SharedFile.query.filter_by(file_id=file.id).options(joinedload(SharedFile.recipient)).all()
+
+def precondition_failed(file, shares):
+    return request.if_match and not request.if_match.contains(file_etag(file, shares))
+
+@app.route('/api/v1/files', methods=['GET'])
+@api_login_required
+def api_v1_list_files():
+    try:
+        fields = api_fields(request.args)
+        sort, limit = page_params(request.args)
+        cursor = request.args.get('cursor')
+        if 'folder' in request.args:
+            folder = get_owned_folder(request.args['folder'])
+            files, next_cursor = folder_files_page(session['user_id'], folder.id if folder else None, sort, cursor, limit)
+        else:
+            files, next_cursor = own_files_page(session['user_id'], sort, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = api_etag('files', [(f.id, f.version) for f in files], next_cursor, fields)
+    if request.if_none_match.contains(etag):
+        # Unchanged: skip serializing altogether
+        return conditional_json({}, etag)
+    return conditional_json({'files': [api_file(f, fields) for f in files], 'next_cursor': next_cursor}, etag)
+
+@app.route('/api/v1/shared', methods=['GET'])
+@api_login_required
+def api_v1_list_shared():
+    try:
+        fields = api_fields(request.args)
+        sort, limit = page_params(request.args)
+        shared, next_cursor = shared_files_page(session['user_id'], sort, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = api_etag('shared', [(s.id, s.file.id, s.file.version) for s in shared], next_cursor, fields)
+    if request.if_none_match.contains(etag):
+        return conditional_json({}, etag)
+    return conditional_json({'files': [api_file(s.file, fields) for s in shared], 'next_cursor': next_cursor}, etag)
+
+@app.route('/api/v1/search', methods=['GET'])
+@api_login_required
+def api_v1_search():
+    """Ranked search over the user's own and shared files (?q=), by filename
+    or, with ?in=content, by the words inside them."""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    target = request.args.get('in', 'name')
+    if target not in ('name', 'content'):
+        return jsonify({'error': 'in must be one of name, content'}), 400
+    try:
+        fields = api_fields(request.args)
+        _, limit = page_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    search = search_content if target == 'content' else search_files
+    files = search(session['user_id'], query, limit)
+    return jsonify({'files': [api_file(f, fields) for f in files]})
+
+@app.route('/api/v1/files/<int:file_id>', methods=['GET'])
+@api_login_required
+def api_v1_get_file(file_id):
+    try:
+        fields = api_fields(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    file = db.session.get(File, file_id)
+    if not file or not can_access(file):
+        return jsonify({'error': 'File not found'}), 404
+    # Only the owner sees who else has access
+    shares = SharedFile.query.filter_by(file_id=file.id).options(joinedload(SharedFile.recipient)).all() if file.owner_id == session['user_id'] else []
+    etag = file_etag(file, shares)
+    return conditional_json(api_file(file, fields, shares if file.owner_id == session['user_id'] else None), etag)
+
+@app.route('/api/v1/uploads', methods=['POST'])
+@api_login_required
+def api_v1_init_upload():
+    """Start an upload: a presigned POST (confirmed via /upload-complete) when
+    the storage accepts direct uploads, otherwise a URL to PUT the body to."""
+    if storage.supports_direct_upload:
+        return upload_url()
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename:
+        return jsonify({'error': 'Missing filename'}), 400
+    return jsonify({
+        'method': 'PUT',
+        'url': url_for('upload_stream', filename=filename, folder_id=data.get('folder_id'), _external=True)
+    })
+
+@app.route('/api/v1/files/<int:file_id>', methods=['PATCH'])
+@api_login_required
+def api_v1_update_file(file_id):
+    """Rename ("filename") and/or move ("folder_id", null for the root)."""
+    file, shares = api_owned_file(file_id)
+    if not file:
+        return jsonify({'error': 'File not found'}), 404
+    if precondition_failed(file, shares):
+        return jsonify({'error': 'File has changed'}), 412
+    data = request.get_json(silent=True) or {}
+    filename = file.filename
+    if 'filename' in data:
+        filename = secure_filename(data['filename'] or '')
+        if not filename:
+            return jsonify({'error': 'Invalid filename'}), 400
+    target_id = file.folder_id
+    if 'folder_id' in data:
+        try:
+            target = get_owned_folder(data['folder_id'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+        target_id = target.id if target else None
+    if target_id != file.folder_id:
+        adjust_folder_usage(file.folder_id, -(file.size or 0), -1)
+        adjust_folder_usage(target_id, file.size or 0, 1)
+    # Assigned together so the row is written, and its version bumped, once
+    file.filename = filename
+    file.folder_id = target_id
+    try:
+        record_file_changes([file], 'update')
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'File has changed'}), 412
+    return conditional_json(api_file(file, shares=shares), file_etag(file, shares))
+
+@app.route('/api/v1/files/<int:file_id>', methods=['DELETE'])
+@api_login_required
+def api_v1_delete_file(file_id):
+    file, shares = api_owned_file(file_id)
+    if not file:
+        return jsonify({'error': 'File not found'}), 404
+    if precondition_failed(file, shares):
+        return jsonify({'error': 'File has changed'}), 412
+    delete_files([file])
+    db.session.commit()
+    return '', 204
+
+@app.route('/api/v1/files/<int:file_id>/shares', methods=['POST'])
+@api_login_required
+def api_v1_share_file(file_id):
+    file, _ = api_owned_file(file_id)
+    if not file:
+        return jsonify({'error': 'File not found'}), 404
+    recipient_input = (request.get_json(silent=True) or {}).get('recipient') or ''
+    recipient = User.query.filter(or_(User.username == recipient_input.lower(), User.email == recipient_input)).first()
+    if not recipient or recipient.id == session['user_id']:
+        return jsonify({'error': 'Unknown recipient'}), 404
+    try:
+        shared = SharedFile(file_id=file.id, shared_with_id=recipient.id)
+        db.session.add(shared)
+        db.session.flush()
+        adjust_share_counts(file.owner_id, [recipient.id], 1)
+        record_share_changes([(file.id, recipient.id, file.owner_id)], 'share')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'File is already shared with this user'}), 409
+    return jsonify({'id': shared.id, 'recipient': recipient.username}), 201
+
+@app.route('/api/v1/files/<int:file_id>/shares/<int:share_id>', methods=['DELETE'])
+@api_login_required
+def api_v1_revoke_share(file_id, share_id):
+    shared = db.session.get(SharedFile, share_id)
+    if not shared or shared.file_id != file_id or session['user_id'] not in (shared.file.owner_id, shared.shared_with_id):
+        return jsonify({'error': 'Share not found'}), 404
+    adjust_share_counts(shared.file.owner_id, [shared.shared_with_id], -1)
+    record_share_changes([(shared.file_id, shared.shared_with_id, shared.file.owner_id)], 'revoke')
+    db.session.delete(shared)
+    db.session.commit()
+    return '', 204
+
+@app.route('/sync', methods=['GET'])
+@api_login_required
+def sync():
+    """Changes to the user's files since `cursor`, the latest change per file
+    with the file's current state (or "deleted" once the user can no longer
+    see it). Without a cursor, or with one older than the compacted journal,
+    clients get a fresh cursor with "reset": they list /api/v1/files again
+    and sync from that cursor; changes made while listing are replayed."""
+    user = db.session.get(User, session['user_id'])
+    cursor = request.args.get('cursor')
+    if cursor is None:
+        return jsonify({'changes': [], 'cursor': str(user.change_seq), 'has_more': False, 'reset': True})
+    if not cursor.isdigit() or int(cursor) > user.change_seq:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    cursor = int(cursor)
+    if cursor < user.sync_floor:
+        return jsonify({'error': 'Cursor has expired', 'cursor': str(user.change_seq), 'reset': True}), 410
+    if cursor == user.change_seq:
+        # Nothing new: answered from the user row alone
+        return jsonify({'changes': [], 'cursor': str(cursor), 'has_more': False})
+
+    limit = app.config['SYNC_PAGE_SIZE']
+    events = db.session.query(ChangeEvent.seq, ChangeEvent.file_id, ChangeEvent.kind).filter(
+        ChangeEvent.user_id == user.id, ChangeEvent.seq > cursor
+    ).order_by(ChangeEvent.seq).limit(limit + 1).all()
+    has_more = len(events) > limit
+    events = events[:limit]
+    latest = {}
+    for _, file_id, kind in events:
+        # Re-inserted so files stay in the order of their latest change
+        latest.pop(file_id, None)
+        latest[file_id] = kind
+
+    files = {f.id: f for f in File.query.filter(File.id.in_(latest)).options(joinedload(File.owner))}
+    shared_with_user = {file_id for (file_id,) in db.session.query(SharedFile.file_id).filter(
+        SharedFile.shared_with_id == user.id, SharedFile.file_id.in_(latest)
+    )}
+    owned_ids = [f.id for f in files.values() if f.owner_id == user.id]
+    shares = defaultdict(list)
+    for shared in SharedFile.query.filter(SharedFile.file_id.in_(owned_ids)).options(joinedload(SharedFile.recipient)):
+        shares[shared.file_id].append(shared)
+
+    changes = []
+    for file_id, kind in latest.items():
+        file = files.get(file_id)
+        if file and file.owner_id == user.id:
+            changes.append({'id': file_id, 'event': kind, 'file': api_file(file, shares=shares[file_id])})
+        elif file and file_id in shared_with_user:
+            changes.append({'id': file_id, 'event': kind, 'file': api_file(file)})
+        else:
+            changes.append({'id': file_id, 'event': kind, 'deleted': True})
+    return jsonify({'changes': changes, 'cursor': str(events[-1].seq), 'has_more': has_more})
+
+@app.cli.command('revoke-sessions')
+@click.argument('username')
+def revoke_sessions(username):
+    """Sign a user out of every device."""
+    user = User.query.filter_by(username=username.lower()).first()
+    if not user:
+        raise click.ClickException(f"No user named {username}")
+    count = session_store.delete_user(user.id)
+    click.echo(f"Revoked {count} session(s) for {user.username}")
+
+
+@app.cli.command('set-quota')
+@click.argument('username')
+@click.argument('quota')
+def set_quota(username, quota):
+    """Set a user's storage quota in bytes: 0 for unlimited, "default" for DEFAULT_QUOTA_BYTES."""
+    user = User.query.filter_by(username=username.lower()).first()
+    if not user:
+        raise click.ClickException(f"No user named {username}")
+    if quota != 'default' and not quota.isdigit():
+        raise click.ClickException("Quota must be a number of bytes or 'default'")
+    user.quota_bytes = None if quota == 'default' else int(quota)
+    db.session.commit()
+    click.echo(f"Quota for {user.username}: {quota_for(user) or 'unlimited'}")
+
+
+@app.cli.command('recount-usage')
+def recount_usage():
+    """Rebuild every usage counter from the file and share rows."""
+    owned = File.query.filter(File.owner_id == User.id)
+    db.session.execute(update(User).values(
+        bytes_used=owned.with_entities(func.coalesce(func.sum(File.size), 0)).scalar_subquery(),
+        file_count=owned.with_entities(func.count(File.id)).scalar_subquery(),
+        shared_by_count=db.session.query(func.count(SharedFile.id)).join(File).filter(File.owner_id == User.id).scalar_subquery(),
+        shared_with_count=db.session.query(func.count(SharedFile.id)).filter(SharedFile.shared_with_id == User.id).scalar_subquery()
+    ))
+    sub = aliased(Folder)
+    in_tree = File.query.join(sub, File.folder_id == sub.id).filter(
+        sub.owner_id == Folder.owner_id,
+        sub.path >= Folder.path,
+        sub.path < func.substr(Folder.path, 1, func.length(Folder.path) - 1).concat('0')
+    )
+    db.session.execute(update(Folder).values(
+        bytes_used=in_tree.with_entities(func.coalesce(func.sum(File.size), 0)).scalar_subquery(),
+        file_count=in_tree.with_entities(func.count(File.id)).scalar_subquery()
+    ))
+    db.session.commit()
+    click.echo("Usage counters rebuilt")
+
+
+@app.cli.command('index-content')
+@click.option('--all', 'reindex_all', is_flag=True, help="Re-index every file, not just pending ones")
+def index_content(reindex_all):
+    """Index the content of files that have no index yet (e.g. uploaded
+    before indexing existed, or whose job failed for good)."""
+    query = db.session.query(File.id)
+    if not reindex_all:
+        query = query.outerjoin(FileText, FileText.file_id == File.id).filter(FileText.file_id.is_(None))
+    file_ids = [file_id for (file_id,) in query.order_by(File.id)]
+    for file_id in file_ids:
+        index_file_content(file_id)
+    # Entries for files deleted while they were being indexed
+    db.session.execute(delete(Posting).where(~Posting.file_id.in_(db.session.query(File.id))))
+    db.session.execute(delete(FileText).where(~FileText.file_id.in_(db.session.query(File.id))))
+    db.session.commit()
+    click.echo(f"Indexed {len(file_ids)} file(s)")
+
+
+@app.cli.command('render-derivatives')
+@click.option('--all', 'render_all', is_flag=True, help="Render every image again, e.g. after changing sizes")
+def render_derivatives(render_all):
+    """Render thumbnails and previews of images that have none yet (e.g.
+    uploaded before thumbnails existed, or while Pillow was missing)."""
+    if render_all:
+        db.session.execute(delete(Derivative))
+        db.session.commit()
+    # One file per stored object is enough; the others share its renditions
+    query = db.session.query(func.min(File.id), File.filename).outerjoin(
+        Derivative, Derivative.source_key == File.s3_key
+    ).filter(Derivative.source_key.is_(None)).group_by(File.s3_key, File.filename)
+    file_ids = sorted({file_id for file_id, filename in query if can_render(filename)})
+    for file_id in file_ids:
+        render_file_derivatives(file_id)
+    click.echo(f"Rendered {len(file_ids)} file(s)")
+
+
+@app.cli.command('compact-changes')
+@click.option('--days', type=int, default=None, help="Retention in days (default CHANGE_RETENTION_DAYS)")
+def compact_changes(days):
+    """Drop superseded and expired entries from the sync change journal."""
+    days = app.config['CHANGE_RETENTION_DAYS'] if days is None else days
+    # Sync only ever sends the latest change per file, so earlier ones for the
+    # same file can go at any age without affecting any cursor
+    later = aliased(ChangeEvent)
+    superseded = db.session.execute(delete(ChangeEvent).where(
+        db.session.query(later.id).filter(
+            later.user_id == ChangeEvent.user_id,
+            later.file_id == ChangeEvent.file_id,
+            later.seq > ChangeEvent.seq
+        ).exists()
+    ), execution_options={'synchronize_session': False}).rowcount
+    # Expired entries are gone for good: cursors from before them must reset
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    floors = dict(db.session.query(ChangeEvent.user_id, func.max(ChangeEvent.seq)).filter(
+        ChangeEvent.created_at < cutoff
+    ).group_by(ChangeEvent.user_id).all())
+    expired = 0
+    if floors:
+        db.session.execute(update(User).where(User.id.in_(floors)).values(
+            sync_floor=case(floors, value=User.id)
+        ), execution_options={'synchronize_session': False})
+        expired = db.session.execute(delete(ChangeEvent).where(ChangeEvent.created_at < cutoff),
+                                     execution_options={'synchronize_session': False}).rowcount
+    db.session.commit()
+    click.echo(f"Removed {superseded} superseded and {expired} expired change(s)")
+
+
+def run_job_worker_process(threads):
+    """Entry point of one `flask run-jobs` worker process."""
+    with app.app_context():
+        # Never share pooled connections with the parent process
+        db.engine.dispose(close=False)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    workers = [threading.Thread(target=job_worker.run, args=(stop,), name=f'job-worker-{n}') for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        stop.set()
+    for worker in workers:
+        worker.join()
+
+
+@app.cli.command('run-jobs')
+@click.option('--processes', type=int, default=1, help="Worker processes to start")
+@click.option('--threads', type=int, default=1, help="Worker threads per process")
+def run_jobs(processes, threads):
+    """Run background jobs until interrupted (SIGTERM or Ctrl-C lets the
+    current jobs finish). Set JOB_INPROCESS_WORKERS=0 on the web servers
+    when jobs run here instead."""
+    if processes <= 1:
+        click.echo(f"Running jobs on {threads} thread(s)")
+        run_job_worker_process(threads)
+        return
+    children = [multiprocessing.Process(target=run_job_worker_process, args=(threads,)) for _ in range(processes)]
+    for child in children:
+        child.start()
+
+    def stop_children(signum=None, frame=None):
+        # Each child finishes its current jobs on SIGTERM
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, stop_children)
+    click.echo(f"Running jobs in {processes} processes with {threads} thread(s) each")
+    try:
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        stop_children()
+        for child in children:
+            child.join()
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
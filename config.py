@@ -19,3 +19,118 @@ class Config:
     AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
     AWS_REGION = os.getenv("AWS_REGION")
     AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
+
+    # Where file content is stored: "s3", or "local" disk under LOCAL_STORAGE_ROOT
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+    LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT") or os.path.join(instance_path, 'storage')
+
+    # S3 client. Each worker process builds one client; size its pool for the
+    # request threads in that worker times the transfer threads per request
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", 8))  # request threads per worker process
+    S3_TRANSFER_MAX_CONCURRENCY = int(os.getenv("S3_TRANSFER_MAX_CONCURRENCY", 4))
+    S3_TRANSFER_THRESHOLD = int(os.getenv("S3_TRANSFER_THRESHOLD", 16 * 1024 ** 2))
+    S3_TRANSFER_CHUNK_SIZE = int(os.getenv("S3_TRANSFER_CHUNK_SIZE", 16 * 1024 ** 2))  # S3 minimum part is 5 MiB
+    S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", max(10, WORKER_THREADS * S3_TRANSFER_MAX_CONCURRENCY)))
+    S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "adaptive")  # adaptive, standard or legacy
+    S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 5))  # including the first try
+    S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", 5))
+    S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", 60))
+
+    # Direct-to-S3 uploads
+    MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 5 * 1024 ** 3))  # S3 single POST limit
+    ALLOWED_UPLOAD_TYPES = [t.strip() for t in os.getenv("ALLOWED_UPLOAD_TYPES", "").split(",") if t.strip()]
+    UPLOAD_URL_EXPIRY = int(os.getenv("UPLOAD_URL_EXPIRY", 900))
+
+    # Resumable multipart uploads
+    MULTIPART_THRESHOLD = int(os.getenv("MULTIPART_THRESHOLD", 64 * 1024 ** 2))
+    MULTIPART_PART_SIZE = int(os.getenv("MULTIPART_PART_SIZE", 16 * 1024 ** 2))  # S3 minimum is 5 MiB
+    MULTIPART_MAX_SIZE = int(os.getenv("MULTIPART_MAX_SIZE", 5 * 1024 ** 4))  # S3 object limit
+    MULTIPART_CONCURRENCY = int(os.getenv("MULTIPART_CONCURRENCY", 4))
+    MULTIPART_SESSION_TTL = int(os.getenv("MULTIPART_SESSION_TTL", 7 * 86400))  # then unfinished sessions are aborted
+
+    # Streaming uploads: request bodies are piped to S3 in chunks of this size
+    UPLOAD_STREAM_CHUNK_SIZE = int(os.getenv("UPLOAD_STREAM_CHUNK_SIZE", 8 * 1024 ** 2))  # S3 minimum part is 5 MiB
+
+    # Presigned download links
+    PRESIGNED_URL_TTL = int(os.getenv("PRESIGNED_URL_TTL", 3600))
+    PRESIGNED_URL_REFRESH = int(os.getenv("PRESIGNED_URL_REFRESH", 900))  # cached links keep >= TTL - REFRESH of validity
+    PRESIGNED_URL_CACHE_SIZE = int(os.getenv("PRESIGNED_URL_CACHE_SIZE", 10000))
+    MAX_BATCH_LINKS = int(os.getenv("MAX_BATCH_LINKS", 500))
+
+    # Storage quota for users without their own quota_bytes; 0 means unlimited
+    DEFAULT_QUOTA_BYTES = int(os.getenv("DEFAULT_QUOTA_BYTES", 0))
+
+    # Bulk delete/share/revoke requests
+    MAX_BULK_FILES = int(os.getenv("MAX_BULK_FILES", 10000))
+
+    # Streaming ZIP downloads: the next ZIP_PREFETCH_FILES files download while
+    # one is written, each buffering at most a few ZIP_CHUNK_SIZE chunks
+    ZIP_MAX_FILES = int(os.getenv("ZIP_MAX_FILES", 10000))
+    ZIP_PREFETCH_FILES = int(os.getenv("ZIP_PREFETCH_FILES", 2))
+    ZIP_CHUNK_SIZE = int(os.getenv("ZIP_CHUNK_SIZE", 1024 ** 2))
+
+    # /download streams content through the app in DOWNLOAD_CHUNK_SIZE reads.
+    # With local storage behind nginx ("x-accel-redirect", an internal
+    # location at DOWNLOAD_ACCEL_PREFIX aliased to LOCAL_STORAGE_ROOT) or
+    # Apache/lighttpd ("x-sendfile"), the web server sends the file instead
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 256 * 1024))
+    DOWNLOAD_OFFLOAD = os.getenv("DOWNLOAD_OFFLOAD", "")
+    DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/protected-files/")
+
+    # Delta sync: changes returned per /sync call, and how long journal
+    # entries are kept before `flask compact-changes` drops them
+    SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", 1000))
+    CHANGE_RETENTION_DAYS = int(os.getenv("CHANGE_RETENTION_DAYS", 30))
+
+    # Content search: indexing reads at most CONTENT_INDEX_MAX_BYTES of each
+    # file and keeps its most frequent terms
+    CONTENT_INDEX_MAX_BYTES = int(os.getenv("CONTENT_INDEX_MAX_BYTES", 20 * 1024 ** 2))
+    CONTENT_INDEX_MAX_TERMS = int(os.getenv("CONTENT_INDEX_MAX_TERMS", 5000))
+
+    # Thumbnails and previews (needs Pillow): longest side in pixels, and the
+    # largest original that is rendered, in RENDER_PROCESSES worker processes
+    THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 256))
+    PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", 1280))
+    DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", 80))
+    RENDER_MAX_BYTES = int(os.getenv("RENDER_MAX_BYTES", 100 * 1024 ** 2))
+    RENDER_MAX_PIXELS = int(os.getenv("RENDER_MAX_PIXELS", 100_000_000))
+    RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", 2))
+    RENDER_TIMEOUT = int(os.getenv("RENDER_TIMEOUT", 60))
+
+    # Background jobs: worker threads inside each web process (0 when only
+    # `flask run-jobs` processes run them), retried with exponential backoff
+    # from JOB_BACKOFF_BASE up to JOB_BACKOFF_MAX seconds
+    JOB_INPROCESS_WORKERS = int(os.getenv("JOB_INPROCESS_WORKERS", 1))
+    JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", 10))
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+    JOB_LEASE = int(os.getenv("JOB_LEASE", 300))  # seconds before a crashed worker's job runs again
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 8))
+    JOB_BACKOFF_BASE = int(os.getenv("JOB_BACKOFF_BASE", 5))
+    JOB_BACKOFF_MAX = int(os.getenv("JOB_BACKOFF_MAX", 3600))
+    JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 7))
+
+    # File list pagination
+    PAGE_SIZE = int(os.getenv("PAGE_SIZE", 50))
+    MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 200))
+
+    # Cognito ID token verification
+    COGNITO_USER_POOL_ID = os.getenv("COGNITO_USER_POOL_ID")
+    COGNITO_ISSUER = os.getenv("COGNITO_ISSUER") or f"https://cognito-idp.{AWS_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}"
+    COGNITO_JWKS_URL = os.getenv("COGNITO_JWKS_URL") or f"{COGNITO_ISSUER}/.well-known/jwks.json"
+    COGNITO_JWKS_FILE = os.getenv("COGNITO_JWKS_FILE")  # local JWKS document, e.g. for tests
+    JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", 3600))
+    JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL", 60))
+
+    # Server-side sessions: "database" is shared by all workers, "memory" is per process
+    SESSION_STORE = os.getenv("SESSION_STORE", "database")
+    SESSION_TTL = int(os.getenv("SESSION_TTL", 8 * 3600))
+    SESSION_MEMORY_MAX_ENTRIES = int(os.getenv("SESSION_MEMORY_MAX_ENTRIES", 10000))
+
+    # Logging: records are queued and shipped to the sink by a background thread
+    LOG_SINK = os.getenv("LOG_SINK", "cloudwatch")  # cloudwatch, stdout or file
+    LOG_FILE = os.getenv("LOG_FILE")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+    LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))
+    LOG_OVERFLOW = os.getenv("LOG_OVERFLOW", "drop")  # drop or block
+    LOG_BLOCK_TIMEOUT = float(os.getenv("LOG_BLOCK_TIMEOUT", 0.05))
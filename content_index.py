@@ -0,0 +1,73 @@
+import html
+import io
+import re
+import zipfile
+from collections import Counter
+
+try:
+    import pypdf
+except ImportError:  # PDFs are only indexed when pypdf is installed
+    pypdf = None
+
+
+TEXT_EXTENSIONS = {'txt', 'md', 'csv', 'tsv', 'json', 'xml', 'html', 'htm', 'log', 'rtf', 'yaml', 'yml', 'ini'}
+# Office Open XML and OpenDocument files are zips; these members hold the text
+OFFICE_MEMBERS = {
+    'docx': re.compile(r'^word/(document|header\d*|footer\d*|footnotes)\.xml$'),
+    'pptx': re.compile(r'^ppt/slides/slide\d+\.xml$'),
+    'xlsx': re.compile(r'^xl/sharedStrings\.xml$'),
+    'odt': re.compile(r'^content\.xml$'),
+    'ods': re.compile(r'^content\.xml$'),
+    'odp': re.compile(r'^content\.xml$'),
+}
+TAG = re.compile(r'<[^>]*>')
+WORD = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+
+class UnsupportedContent(Exception):
+    pass
+
+
+def extension(filename):
+    return filename.rpartition('.')[2].lower() if '.' in filename else ''
+
+
+def can_extract(filename, content_type=None):
+    ext = extension(filename)
+    if ext == 'pdf':
+        return pypdf is not None
+    return ext in TEXT_EXTENSIONS or ext in OFFICE_MEMBERS or (content_type or '').startswith('text/')
+
+
+def extract_text(data, filename, content_type=None, max_bytes=20 * 1024 ** 2):
+    """Plain text of a document held in `data` (bytes). Office members are
+    decompressed at most `max_bytes` each, so a zip bomb cannot blow up memory."""
+    ext = extension(filename)
+    if ext == 'pdf' and pypdf is not None:
+        reader = pypdf.PdfReader(io.BytesIO(data))
+        return '\n'.join(page.extract_text() or '' for page in reader.pages)
+    if ext in OFFICE_MEMBERS:
+        parts = []
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for name in sorted(archive.namelist()):
+                if OFFICE_MEMBERS[ext].match(name):
+                    with archive.open(name) as member:
+                        xml = member.read(max_bytes).decode('utf-8', errors='replace')
+                    parts.append(html.unescape(TAG.sub(' ', xml)))
+        return '\n'.join(parts)
+    if ext in TEXT_EXTENSIONS or (content_type or '').startswith('text/'):
+        text = data.decode('utf-8', errors='replace')
+        return html.unescape(TAG.sub(' ', text)) if ext in ('html', 'htm', 'xml') else text
+    raise UnsupportedContent(f"Cannot extract text from {filename}")
+
+
+def tokenize(text, max_terms=5000):
+    """Term frequencies of the lower-cased words in `text`, keeping the
+    `max_terms` most frequent so one huge document cannot flood the index."""
+    counts = Counter(
+        word for word in WORD.findall(text.lower())
+        if 2 <= len(word) <= MAX_TERM_LENGTH
+    )
+    return dict(counts.most_common(max_terms))
+
@@ -0,0 +1,118 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # no thumbnails or previews without Pillow
+    Image = ImageOps = None
+
+try:
+    import pypdfium2
+except ImportError:  # PDFs only get a first-page render when pypdfium2 is installed
+    pypdfium2 = None
+
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'}
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def extension(filename):
+    return filename.rpartition('.')[2].lower() if '.' in filename else ''
+
+
+def can_render(filename):
+    if Image is None:
+        return False
+    ext = extension(filename)
+    if ext == 'pdf':
+        return pypdfium2 is not None
+    return ext in IMAGE_EXTENSIONS
+
+
+def open_image(data, filename, size, max_pixels):
+    ext = extension(filename)
+    if ext == 'pdf':
+        pdf = pypdfium2.PdfDocument(data)
+        try:
+            page = pdf[0]
+            width, height = page.get_size()
+            # Rendered straight at the largest size we need, never at full resolution
+            return page.render(scale=size / max(width, height, 1)).to_pil(), (round(width), round(height))
+        finally:
+            pdf.close()
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    image = Image.open(io.BytesIO(data))
+    original = image.size
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale, far cheaper than decoding
+    # everything and shrinking afterwards
+    image.draft('RGB', (size, size))
+    return ImageOps.exif_transpose(image), original
+
+
+def render(data, filename, sizes, quality=80, max_pixels=100_000_000):
+    """JPEG renditions of an image (or a PDF's first page) held in `data`,
+    each fitting in a square of sizes[name] pixels. Returns the source
+    (width, height) and {name: jpeg bytes}. Runs in a worker process."""
+    try:
+        image, original = open_image(data, filename, max(sizes.values()), max_pixels)
+        if image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha: flatten transparent images onto white
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        images = {}
+        for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=quality, optimize=True, progressive=size > 512)
+            images[name] = out.getvalue()
+    except Exception as e:
+        # Bad or hostile input; raised as one type so the caller can tell it
+        # from a crashed or stuck worker
+        raise UnsupportedImage(f"Cannot render {filename}: {type(e).__name__}: {e}")
+    return original, images
+
+
+class RenderPool:
+    """A process pool for `render`, so decoding large images neither holds
+    the GIL nor grows the web process. The pool starts on first use, once
+    per process; workers are spawned, not forked from a threaded parent, and
+    replaced after `max_tasks` renders so fragmented memory is returned."""
+
+    def __init__(self, processes=2, timeout=60, max_tasks=100):
+        self.processes = processes
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        max_tasks_per_child=self.max_tasks
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def render(self, data, filename, sizes, **kwargs):
+        pool = self.pool()
+        try:
+            return pool.submit(render, data, filename, sizes, **kwargs).result(self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start afresh next time
+            with self._lock:
+                if self._pool is pool:
+                    self._pool_pid = None
+            raise
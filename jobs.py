@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import select, insert, update, delete, and_, or_
+
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class JobQueue:
+    """Durable job queue in a SQL table (id, kind, payload, key, status,
+    attempts, max_attempts, run_at, locked_by, locked_until, last_error,
+    created_at, finished_at), shared by every web and worker process.
+
+    Jobs are enqueued in the caller's transaction, so they exist exactly when
+    the change that needs them commits. A job with an idempotency `key` is
+    only enqueued once while it is kept. Claimed jobs are leased for `lease`
+    seconds; a worker that dies loses its lease and the job runs again, so
+    handlers must be safe to repeat. Failures retry with exponential backoff
+    and jitter up to the job's max_attempts.
+    """
+
+    def __init__(self, table, get_engine, lease=300, max_attempts=8, backoff_base=5, backoff_max=3600):
+        self.table = table
+        self.get_engine = get_engine
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _insert(self):
+        dialect = self.get_engine().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            return insert(self.table)
+        return dialect_insert(self.table).on_conflict_do_nothing(index_elements=['key'])
+
+    def enqueue(self, executor, kind, payload, key=None, delay=0, max_attempts=None):
+        """Add a job through `executor` (a Session or Connection, so it joins
+        that transaction)."""
+        now = utcnow()
+        executor.execute(self._insert().values(
+            kind=kind,
+            payload=json.dumps(payload),
+            key=key,
+            status='queued',
+            attempts=0,
+            max_attempts=max_attempts or self.max_attempts,
+            run_at=now + timedelta(seconds=delay),
+            created_at=now
+        ))
+
+    def claim(self, worker_id, limit):
+        """Lease up to `limit` due jobs to `worker_id`. Concurrent workers
+        skip each other's rows (SKIP LOCKED) rather than wait on them."""
+        t = self.table
+        now = utcnow()
+        due = select(t.c.id).where(or_(
+            and_(t.c.status == 'queued', t.c.run_at <= now),
+            and_(t.c.status == 'running', t.c.locked_until < now)
+        )).order_by(t.c.run_at).limit(limit).with_for_update(skip_locked=True)
+        with self.get_engine().begin() as conn:
+            return conn.execute(
+                update(t).where(t.c.id.in_(due)).values(
+                    status='running',
+                    locked_by=worker_id,
+                    locked_until=now + timedelta(seconds=self.lease),
+                    attempts=t.c.attempts + 1
+                ).returning(t.c.id, t.c.kind, t.c.payload, t.c.attempts, t.c.max_attempts)
+            ).all()
+
+    def complete(self, job, worker_id):
+        self._finish(job, worker_id, status='done', finished_at=utcnow(), last_error=None)
+
+    def fail(self, job, worker_id, error):
+        if job.attempts >= job.max_attempts:
+            self._finish(job, worker_id, status='failed', finished_at=utcnow(), last_error=error)
+            return False
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+        self._finish(job, worker_id, status='queued', run_at=utcnow() + timedelta(seconds=delay * random.uniform(0.5, 1)),
+                     last_error=error)
+        return True
+
+    def _finish(self, job, worker_id, **values):
+        # Only while we still hold the lease; otherwise another worker owns it
+        t = self.table
+        with self.get_engine().begin() as conn:
+            conn.execute(update(t).where(t.c.id == job.id, t.c.locked_by == worker_id).values(
+                locked_by=None, locked_until=None, **values
+            ))
+
+    def purge(self, older_than):
+        """Drop jobs that finished (done or failed) more than `older_than` seconds ago."""
+        cutoff = utcnow() - timedelta(seconds=older_than)
+        t = self.table
+        with self.get_engine().begin() as conn:
+            return conn.execute(delete(t).where(t.c.status.in_(('done', 'failed')), t.c.finished_at < cutoff)).rowcount
+
+
+class JobWorker:
+    """Claims jobs in batches and runs `handlers[kind](payload)` for each,
+    inside `context()` (e.g. a Flask app context). Sleeps `poll_interval`
+    seconds when the queue is empty and purges old finished jobs every
+    `purge_interval` seconds. Failures are reported to `log`."""
+
+    def __init__(self, queue, handlers, context, batch_size=10, poll_interval=1.0,
+                 retention=7 * 86400, purge_interval=3600, log=None):
+        self.queue = queue
+        self.log = log or logger
+        self.handlers = handlers
+        self.context = context
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.processed = 0
+        self.failed = 0
+        self._last_purge = time.monotonic()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def run_once(self, worker_id=None):
+        """Run one batch; returns how many jobs were claimed."""
+        worker_id = worker_id or f"{self.worker_id}:{threading.get_ident()}"
+        with self.context():
+            jobs = self.queue.claim(worker_id, self.batch_size)
+        for job in jobs:
+            # A fresh context per job, so no state leaks from one to the next
+            with self.context():
+                self._run_job(job, worker_id)
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            with self.context():
+                self.queue.purge(self.retention)
+        return len(jobs)
+
+    def _run_job(self, job, worker_id):
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job.kind}")
+            handler(json.loads(job.payload))
+        except Exception as e:
+            self.failed += 1
+            retrying = self.queue.fail(job, worker_id, f"{type(e).__name__}: {e}")
+            self.log.error("Job %s (%s) failed on attempt %s%s: %s", job.id, job.kind, job.attempts,
+                         "" if retrying else ", giving up", e)
+        else:
+            self.queue.complete(job, worker_id)
+            self.processed += 1
+
+    def run(self, stop):
+        """Work until the `stop` event is set, finishing the current batch."""
+        while not stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                self.log.error("Job worker %s could not claim jobs: %s", self.worker_id, e)
+                claimed = 0
+            if not claimed:
+                stop.wait(self.poll_interval)
+
+    def start_threads(self, count):
+        """Run `count` daemon worker threads in this process, started once per
+        process so workers forked from a preloaded app get their own."""
+        if count <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+                stop = threading.Event()
+                for n in range(count):
+                    threading.Thread(target=self.run, args=(stop,), name=f'job-worker-{n}', daemon=True).start()
+                self._pid = os.getpid()
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+
+import requests
+from jose import jwk, jwt, JWTError
+
+
+# Key sources return a JWK Set document ({"keys": [...]})
+class HTTPKeySource:
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class FileKeySource:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+
+class JWKSCache:
+    """Parsed signing keys by kid, fetched once and kept for `ttl` seconds.
+
+    An unknown kid triggers an early refresh (Cognito rotates keys), but at
+    most once per `min_refresh_interval` so bogus kids cannot hammer the source.
+    """
+
+    def __init__(self, source, ttl=3600, min_refresh_interval=60):
+        self.source = source
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        if self._fetched_at is None or now - self._fetched_at >= self.ttl:
+            self._refresh(now)
+        elif kid not in self._keys and now - self._fetched_at >= self.min_refresh_interval:
+            self._refresh(now)
+        return self._keys.get(kid)
+
+    def _refresh(self, now):
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._fetched_at is not None and self._fetched_at >= now:
+                return
+            try:
+                jwks = self.source.fetch()
+            except Exception:
+                if not self._keys:
+                    raise
+                # Keep verifying with the stale keys and retry a little later
+                self._fetched_at = time.monotonic() - self.ttl + self.min_refresh_interval
+                return
+            self._keys = {k['kid']: jwk.construct(k) for k in jwks.get('keys', []) if 'kid' in k}
+            self._fetched_at = time.monotonic()
+
+
+class TokenVerifier:
+    def __init__(self, keys, issuer, audience, algorithms=('RS256',)):
+        self.keys = keys
+        self.issuer = issuer
+        self.audience = audience
+        self.algorithms = list(algorithms)
+
+    def verify(self, token, access_token=None):
+        """Return the claims of a valid Cognito ID token, or raise JWTError.
+        Pass the access_token issued with it so its at_hash claim is checked."""
+        header = jwt.get_unverified_header(token)
+        key = self.keys.get_key(header.get('kid'))
+        if key is None:
+            raise JWTError("Token signed with an unknown key")
+        claims = jwt.decode(token, key, algorithms=self.algorithms, audience=self.audience, issuer=self.issuer,
+                            access_token=access_token)
+        if claims.get('token_use') != 'id':
+            raise JWTError("Not an ID token")
+        return claims
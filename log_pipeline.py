@@ -0,0 +1,120 @@
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a bounded queue without formatting them.
+
+    When the queue is full the record is dropped ("drop"), or the caller
+    waits up to `block_timeout` seconds for room before dropping ("block").
+    With a `listener`, it is started in this process before the first record.
+    """
+
+    def __init__(self, log_queue, overflow='drop', block_timeout=0.05, listener=None):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.listener = listener
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The stock QueueHandler formats here, on the request thread. The
+        # listener lives in this process, so pass the record through untouched
+        # and let the sink format it when it is actually emitted.
+        return record
+
+    def enqueue(self, record):
+        if self.listener is not None:
+            self.listener.start()
+        try:
+            if self.overflow == 'block':
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener:
+    """Drains the queue on a background thread and passes records to the
+    sinks in batches of up to `batch_size`, flushing them after each batch
+    or at least every `flush_interval` seconds. The thread runs once per
+    process: workers forked from a preloaded app start their own."""
+
+    _sentinel = None
+
+    def __init__(self, log_queue, handlers, batch_size=500, flush_interval=1.0):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.emitted = 0
+        self.batches = 0
+        self.errors = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._pid is not None:
+                    # Forked: the queue's locks may have been copied while
+                    # held, and its records are the parent's to ship
+                    self.queue.__init__(self.queue.maxsize)
+                self._thread = threading.Thread(target=self._run, name='log-listener', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        if self._thread and self._pid == os.getpid():
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    stopping = True
+                    break
+                batch.append(record)
+            if batch:
+                self._emit(batch)
+
+    def _emit(self, batch):
+        for handler in self.handlers:
+            for record in batch:
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        self.errors += 1
+            try:
+                handler.flush()
+            except Exception:
+                self.errors += 1
+        self.emitted += len(batch)
+        self.batches += 1
+
+
+def local_log_handler(log_file=None):
+    handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    return handler
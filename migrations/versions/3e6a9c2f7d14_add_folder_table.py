@@ -0,0 +1,62 @@
+"""Add folder table with materialized paths
+
+Revision ID: 3e6a9c2f7d14
+Revises: 7d2f6b9c4e85
+Create Date: 2026-10-18 17:42:13.508216
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3e6a9c2f7d14'
+down_revision = '7d2f6b9c4e85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('folder',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=256), nullable=False),
+        sa.Column('path', sa.String(length=1024).with_variant(postgresql.VARCHAR(length=1024, collation='C'), 'postgresql'), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['parent_id'], ['folder.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('folder', schema=None) as batch_op:
+        batch_op.create_index('ix_folder_owner_id_path', ['owner_id', 'path'], unique=False)
+        batch_op.create_index('ix_folder_parent_id_name', ['parent_id', 'name'], unique=False)
+
+    # Existing files stay in their owner's root (folder_id NULL)
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('folder_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_file_owner_id_folder_id_uploaded_at_id', ['owner_id', 'folder_id', 'uploaded_at', 'id'], unique=False)
+        batch_op.create_foreign_key('fk_file_folder_id_folder', 'folder', ['folder_id'], ['id'])
+
+    with op.batch_alter_table('upload_session', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('folder_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_upload_session_folder_id_folder', 'folder', ['folder_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('upload_session', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_upload_session_folder_id_folder', type_='foreignkey')
+        batch_op.drop_column('folder_id')
+
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_file_folder_id_folder', type_='foreignkey')
+        batch_op.drop_index('ix_file_owner_id_folder_id_uploaded_at_id')
+        batch_op.drop_column('folder_id')
+
+    with op.batch_alter_table('folder', schema=None) as batch_op:
+        batch_op.drop_index('ix_folder_parent_id_name')
+        batch_op.drop_index('ix_folder_owner_id_path')
+
+    op.drop_table('folder')
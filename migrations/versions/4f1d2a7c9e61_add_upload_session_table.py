@@ -0,0 +1,52 @@
+"""Add upload_session table for resumable multipart uploads
+
+Revision ID: 4f1d2a7c9e61
+Revises: 32c890038578
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1d2a7c9e61'
+down_revision = '32c890038578'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_session',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('upload_id', sa.String(length=1024), nullable=False),
+        sa.Column('s3_key', sa.String(length=512), nullable=False),
+        sa.Column('filename', sa.String(length=256), nullable=False),
+        sa.Column('content_type', sa.String(length=128), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('part_size', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ),
+        sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # Multipart uploads can exceed the 2 GiB range of a 32-bit integer
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.alter_column('size',
+               existing_type=sa.Integer(),
+               type_=sa.BigInteger(),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.alter_column('size',
+               existing_type=sa.BigInteger(),
+               type_=sa.Integer(),
+               existing_nullable=True)
+
+    op.drop_table('upload_session')
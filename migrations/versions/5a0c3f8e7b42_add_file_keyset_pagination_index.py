@@ -0,0 +1,26 @@
+"""Add index for keyset pagination of files by upload time
+
+Revision ID: 5a0c3f8e7b42
+Revises: e2b94c6a1d38
+Create Date: 2026-10-18 13:55:19.214630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a0c3f8e7b42'
+down_revision = 'e2b94c6a1d38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.create_index('ix_file_owner_id_uploaded_at_id', ['owner_id', 'uploaded_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_index('ix_file_owner_id_uploaded_at_id')
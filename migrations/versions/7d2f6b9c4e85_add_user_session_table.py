@@ -0,0 +1,38 @@
+"""Add user_session table for server-side sessions
+
+Revision ID: 7d2f6b9c4e85
+Revises: 5a0c3f8e7b42
+Create Date: 2026-10-18 15:08:36.471122
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f6b9c4e85'
+down_revision = '5a0c3f8e7b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_session',
+        sa.Column('id', sa.String(length=64), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_session_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_user_session_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_session_user_id'))
+        batch_op.drop_index(batch_op.f('ix_user_session_expires_at'))
+
+    op.drop_table('user_session')
@@ -0,0 +1,61 @@
+"""Add usage counters and quotas to user and folder
+
+Revision ID: 8c1f4b7e2a96
+Revises: 3e6a9c2f7d14
+Create Date: 2026-10-18 18:31:52.117640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1f4b7e2a96'
+down_revision = '3e6a9c2f7d14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bytes_used', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('file_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('shared_by_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('shared_with_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('quota_bytes', sa.BigInteger(), nullable=True))
+
+    with op.batch_alter_table('folder', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bytes_used', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('file_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from the existing rows; from here on the app keeps them current
+    op.execute("""
+        UPDATE "user" SET
+            bytes_used = (SELECT COALESCE(SUM(file.size), 0) FROM file WHERE file.owner_id = "user".id),
+            file_count = (SELECT COUNT(file.id) FROM file WHERE file.owner_id = "user".id),
+            shared_by_count = (SELECT COUNT(shared_file.id) FROM shared_file JOIN file ON shared_file.file_id = file.id
+                               WHERE file.owner_id = "user".id),
+            shared_with_count = (SELECT COUNT(shared_file.id) FROM shared_file WHERE shared_file.shared_with_id = "user".id)
+    """)
+    op.execute("""
+        UPDATE folder SET
+            bytes_used = (SELECT COALESCE(SUM(file.size), 0) FROM file JOIN folder AS sub ON file.folder_id = sub.id
+                          WHERE sub.owner_id = folder.owner_id AND sub.path >= folder.path
+                          AND sub.path < SUBSTR(folder.path, 1, LENGTH(folder.path) - 1) || '0'),
+            file_count = (SELECT COUNT(file.id) FROM file JOIN folder AS sub ON file.folder_id = sub.id
+                          WHERE sub.owner_id = folder.owner_id AND sub.path >= folder.path
+                          AND sub.path < SUBSTR(folder.path, 1, LENGTH(folder.path) - 1) || '0')
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('folder', schema=None) as batch_op:
+        batch_op.drop_column('file_count')
+        batch_op.drop_column('bytes_used')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('quota_bytes')
+        batch_op.drop_column('shared_with_count')
+        batch_op.drop_column('shared_by_count')
+        batch_op.drop_column('file_count')
+        batch_op.drop_column('bytes_used')
@@ -0,0 +1,26 @@
+"""Add sha256 checksum column to File
+
+Revision ID: 9b3e5d1f0a27
+Revises: 4f1d2a7c9e61
+Create Date: 2026-10-18 10:02:13.550918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5d1f0a27'
+down_revision = '4f1d2a7c9e61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_column('sha256')
@@ -0,0 +1,44 @@
+"""Add content index tables
+
+Revision ID: a6c3e9f1d275
+Revises: f3a9d2c7b814
+Create Date: 2026-10-18 21:26:37.281944
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c3e9f1d275'
+down_revision = 'f3a9d2c7b814'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_text',
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('term_count', sa.Integer(), nullable=False),
+    sa.Column('indexed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('file_id')
+    )
+    op.create_table('posting',
+    sa.Column('term', sa.String(length=64), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('tf', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('term', 'file_id')
+    )
+    with op.batch_alter_table('posting', schema=None) as batch_op:
+        batch_op.create_index('ix_posting_file_id', ['file_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posting', schema=None) as batch_op:
+        batch_op.drop_index('ix_posting_file_id')
+
+    op.drop_table('posting')
+    op.drop_table('file_text')
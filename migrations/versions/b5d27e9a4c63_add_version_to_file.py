@@ -0,0 +1,26 @@
+"""Add version column to file
+
+Revision ID: b5d27e9a4c63
+Revises: 8c1f4b7e2a96
+Create Date: 2026-10-18 19:24:07.930415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d27e9a4c63'
+down_revision = '8c1f4b7e2a96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,54 @@
+"""Make file.uploaded_at NOT NULL
+
+Revision ID: b9f4c2e6d817
+Revises: e7b1d4c9a352
+Create Date: 2026-10-19 09:41:27.552913
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9f4c2e6d817'
+down_revision = 'e7b1d4c9a352'
+branch_labels = None
+depends_on = None
+
+# SQLite rebuilds the table for the ALTER, which drops its triggers
+FILE_SEARCH_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS file_search_ai AFTER INSERT ON file BEGIN "
+    "INSERT INTO file_search(rowid, filename) VALUES (new.id, new.filename); END",
+    "CREATE TRIGGER IF NOT EXISTS file_search_ad AFTER DELETE ON file BEGIN "
+    "INSERT INTO file_search(file_search, rowid, filename) VALUES ('delete', old.id, old.filename); END",
+    "CREATE TRIGGER IF NOT EXISTS file_search_au AFTER UPDATE OF filename ON file BEGIN "
+    "INSERT INTO file_search(file_search, rowid, filename) VALUES ('delete', old.id, old.filename); "
+    "INSERT INTO file_search(rowid, filename) VALUES (new.id, new.filename); END",
+]
+
+
+def alter_uploaded_at(nullable):
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.alter_column('uploaded_at',
+               existing_type=sa.DateTime(),
+               nullable=nullable)
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in FILE_SEARCH_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    # Keyset pagination cannot order or resume on NULL; legacy rows without an
+    # upload time sort as the oldest files
+    # Bound as a DateTime so it is stored in the same format as every other
+    # row (on SQLite, with microseconds) and compares correctly with them
+    op.execute(sa.text("UPDATE file SET uploaded_at = :epoch WHERE uploaded_at IS NULL").bindparams(
+        sa.bindparam('epoch', datetime(1970, 1, 1), type_=sa.DateTime())
+    ))
+    alter_uploaded_at(nullable=False)
+
+
+def downgrade():
+    alter_uploaded_at(nullable=True)
@@ -0,0 +1,42 @@
+"""Add blob table for content-addressed deduplication
+
+Revision ID: c7a84e2d5b10
+Revises: 9b3e5d1f0a27
+Create Date: 2026-10-18 11:27:05.306771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a84e2d5b10'
+down_revision = '9b3e5d1f0a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blob',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('s3_key', sa.String(length=512), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sha256')
+    )
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('blob_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_file_blob_id'), ['blob_id'], unique=False)
+        batch_op.create_foreign_key('fk_file_blob_id_blob', 'blob', ['blob_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_file_blob_id_blob', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_file_blob_id'))
+        batch_op.drop_column('blob_id')
+
+    op.drop_table('blob')
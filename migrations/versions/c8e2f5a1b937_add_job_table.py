@@ -0,0 +1,45 @@
+"""Add job table for the background job queue
+
+Revision ID: c8e2f5a1b937
+Revises: a6c3e9f1d275
+Create Date: 2026-10-18 22:05:51.730418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2f5a1b937'
+down_revision = 'a6c3e9f1d275'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('kind', sa.String(length=64), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_by', sa.String(length=128), nullable=True),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key')
+    )
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index('ix_job_status_run_at', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_status_run_at')
+
+    op.drop_table('job')
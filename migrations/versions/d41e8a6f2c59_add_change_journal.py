@@ -0,0 +1,47 @@
+"""Add change journal for delta sync
+
+Revision ID: d41e8a6f2c59
+Revises: b5d27e9a4c63
+Create Date: 2026-10-18 20:11:42.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41e8a6f2c59'
+down_revision = 'b5d27e9a4c63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_event',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'seq', name='uq_change_event_user_id_seq')
+    )
+    with op.batch_alter_table('change_event', schema=None) as batch_op:
+        batch_op.create_index('ix_change_event_created_at', ['created_at'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('sync_floor', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('sync_floor')
+        batch_op.drop_column('change_seq')
+
+    with op.batch_alter_table('change_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_change_event_created_at')
+
+    op.drop_table('change_event')
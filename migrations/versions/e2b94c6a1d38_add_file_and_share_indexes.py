@@ -0,0 +1,44 @@
+"""Add indexes on file and shared_file, unique share per recipient
+
+Revision ID: e2b94c6a1d38
+Revises: c7a84e2d5b10
+Create Date: 2026-10-18 12:40:51.902467
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b94c6a1d38'
+down_revision = 'c7a84e2d5b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Drop duplicate shares so the unique constraint can be created
+    op.execute("""
+        DELETE FROM shared_file
+        WHERE id NOT IN (
+            SELECT keep_id FROM (
+                SELECT MIN(id) AS keep_id FROM shared_file GROUP BY file_id, shared_with_id
+            ) AS keep
+        )
+    """)
+
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.create_index('ix_file_owner_id_filename', ['owner_id', 'filename'], unique=False)
+
+    with op.batch_alter_table('shared_file', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_shared_file_shared_with_id'), ['shared_with_id'], unique=False)
+        batch_op.create_unique_constraint('uq_shared_file_file_id_shared_with_id', ['file_id', 'shared_with_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('shared_file', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_shared_file_file_id_shared_with_id', type_='unique')
+        batch_op.drop_index(batch_op.f('ix_shared_file_shared_with_id'))
+
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_index('ix_file_owner_id_filename')
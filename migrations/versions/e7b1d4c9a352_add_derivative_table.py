@@ -0,0 +1,31 @@
+"""Add derivative table for thumbnails and previews
+
+Revision ID: e7b1d4c9a352
+Revises: c8e2f5a1b937
+Create Date: 2026-10-18 23:12:40.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b1d4c9a352'
+down_revision = 'c8e2f5a1b937'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('derivative',
+    sa.Column('source_key', sa.String(length=512), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('rendered_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('source_key')
+    )
+
+
+def downgrade():
+    op.drop_table('derivative')
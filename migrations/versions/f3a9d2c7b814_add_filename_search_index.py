@@ -0,0 +1,46 @@
+"""Add filename search index
+
+Revision ID: f3a9d2c7b814
+Revises: d41e8a6f2c59
+Create Date: 2026-10-18 20:48:15.604127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d2c7b814'
+down_revision = 'd41e8a6f2c59'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE file_search USING fts5("
+                   "filename, content='file', content_rowid='id', tokenize='trigram')")
+        op.execute("CREATE TRIGGER file_search_ai AFTER INSERT ON file BEGIN "
+                   "INSERT INTO file_search(rowid, filename) VALUES (new.id, new.filename); END")
+        op.execute("CREATE TRIGGER file_search_ad AFTER DELETE ON file BEGIN "
+                   "INSERT INTO file_search(file_search, rowid, filename) VALUES ('delete', old.id, old.filename); END")
+        op.execute("CREATE TRIGGER file_search_au AFTER UPDATE OF filename ON file BEGIN "
+                   "INSERT INTO file_search(file_search, rowid, filename) VALUES ('delete', old.id, old.filename); "
+                   "INSERT INTO file_search(rowid, filename) VALUES (new.id, new.filename); END")
+        # Index the existing rows
+        op.execute("INSERT INTO file_search(file_search) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX ix_file_filename_trgm ON file USING gin (filename gin_trgm_ops)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER file_search_au")
+        op.execute("DROP TRIGGER file_search_ad")
+        op.execute("DROP TRIGGER file_search_ai")
+        op.execute("DROP TABLE file_search")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX ix_file_filename_trgm")
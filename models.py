@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
 
 db = SQLAlchemy()
 
@@ -12,6 +14,17 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(128), nullable=True)
     created_at = db.Column(db.DateTime)
 
+    # Usage counters, kept up to date with every file and share change
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shared_by_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shared_with_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    quota_bytes = db.Column(db.BigInteger)  # None falls back to DEFAULT_QUOTA_BYTES
+    # Sequence number of this user's latest ChangeEvent, and the newest one
+    # compacted away: sync cursors older than that must start over
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    sync_floor = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
     uploads = db.relationship('File', backref='owner', lazy=True)
 
     # Files shared with this user
@@ -24,14 +37,30 @@ class User(db.Model, UserMixin):
 
 class File(db.Model):
     __tablename__ = 'file'
+    __table_args__ = (
+        # Also serves lookups by owner_id alone
+        db.Index('ix_file_owner_id_filename', 'owner_id', 'filename'),
+        # Keyset pagination of an owner's files by upload time
+        db.Index('ix_file_owner_id_uploaded_at_id', 'owner_id', 'uploaded_at', 'id'),
+        # The same within one folder (folder_id IS NULL is the owner's root)
+        db.Index('ix_file_owner_id_folder_id_uploaded_at_id', 'owner_id', 'folder_id', 'uploaded_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(256), nullable=False)
     s3_key = db.Column(db.String(512), nullable=False)
-    size = db.Column(db.Integer)
-    uploaded_at = db.Column(db.DateTime)
+    size = db.Column(db.BigInteger)
+    sha256 = db.Column(db.String(64))
+    uploaded_at = db.Column(db.DateTime, nullable=False)
 
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Set when the content is stored as a shared, deduplicated blob
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), index=True)
+    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'))
+    # Bumped by the ORM on every update; API ETags are derived from it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     shared_with = db.relationship(
         'SharedFile',
@@ -40,9 +69,185 @@ class File(db.Model):
         cascade='all, delete-orphan'
     )
 
+# Filename search index. SQLite gets an FTS5 trigram table over file.filename
+# (external content, no copy of the names) kept current by triggers, so every
+# insert, rename and delete is indexed whichever code path makes it; PostgreSQL
+# gets a pg_trgm GIN index. Neither is in the metadata (migrations/env.py
+# skips them): they are created here for create_all() and by the migration
+# for existing databases. A batch migration that recreates the file table on
+# SQLite drops the triggers and must create them again.
+FILE_SEARCH_DDL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5("
+        "filename, content='file', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS file_search_ai AFTER INSERT ON file BEGIN "
+        "INSERT INTO file_search(rowid, filename) VALUES (new.id, new.filename); END",
+        "CREATE TRIGGER IF NOT EXISTS file_search_ad AFTER DELETE ON file BEGIN "
+        "INSERT INTO file_search(file_search, rowid, filename) VALUES ('delete', old.id, old.filename); END",
+        "CREATE TRIGGER IF NOT EXISTS file_search_au AFTER UPDATE OF filename ON file BEGIN "
+        "INSERT INTO file_search(file_search, rowid, filename) VALUES ('delete', old.id, old.filename); "
+        "INSERT INTO file_search(rowid, filename) VALUES (new.id, new.filename); END",
+    ],
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_file_filename_trgm ON file USING gin (filename gin_trgm_ops)",
+    ],
+}
+
+@event.listens_for(File.__table__, 'after_create')
+def create_file_search(target, connection, **kw):
+    for statement in FILE_SEARCH_DDL.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement)
+
+@event.listens_for(File.__table__, 'before_drop')
+def drop_file_search(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("DROP TABLE IF EXISTS file_search")
+
 class SharedFile(db.Model):
     __tablename__ = 'shared_file'
+    __table_args__ = (
+        # Also serves lookups by file_id alone
+        db.UniqueConstraint('file_id', 'shared_with_id', name='uq_shared_file_file_id_shared_with_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False)
-    shared_with_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    shared_with_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_session'
+
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.String(1024), nullable=False)  # S3 multipart UploadId
+    s3_key = db.Column(db.String(512), nullable=False)
+    filename = db.Column(db.String(256), nullable=False)
+    content_type = db.Column(db.String(128))
+    size = db.Column(db.BigInteger, nullable=False)
+    part_size = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='active')  # active, completed, aborted
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'))
+    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id', ondelete='SET NULL'))
+
+    owner = db.relationship('User', backref=db.backref('upload_sessions', lazy=True))
+
+class Blob(db.Model):
+    __tablename__ = 'blob'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    s3_key = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.BigInteger)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+
+    files = db.relationship('File', backref='blob', lazy=True)
+
+class UserSession(db.Model):
+    __tablename__ = 'user_session'
+
+    id = db.Column(db.String(64), primary_key=True)  # opaque id carried in the session cookie
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class Folder(db.Model):
+    __tablename__ = 'folder'
+    __table_args__ = (
+        # A subtree is a range of paths within one owner
+        db.Index('ix_folder_owner_id_path', 'owner_id', 'path'),
+        db.Index('ix_folder_parent_id_name', 'parent_id', 'name'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(256), nullable=False)
+    # Materialized path of folder ids, e.g. "/3/17/42/" for folder 42. Ids
+    # never change, so renaming a folder leaves every path alone. Compared
+    # bytewise ("C" collation on PostgreSQL) so subtree ranges stay contiguous.
+    path = db.Column(db.String(1024).with_variant(postgresql.VARCHAR(1024, collation='C'), 'postgresql'), nullable=False)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+    # Totals for the whole subtree, not just the folder's own files
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    parent_id = db.Column(db.Integer, db.ForeignKey('folder.id'))
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    files = db.relationship('File', backref='folder', lazy=True)
+
+class ChangeEvent(db.Model):
+    """One entry in a user's change journal: something happened to a file
+    they own or that is shared with them. `seq` counts up per user and is
+    what sync cursors refer to."""
+    __tablename__ = 'change_event'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'seq', name='uq_change_event_user_id_seq'),
+        db.Index('ix_change_event_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.BigInteger, nullable=False)
+    # No foreign key: the journal outlives deleted files
+    file_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)  # insert, rename, move, update, delete, share, revoke
+    created_at = db.Column(db.DateTime, nullable=False)
+
+class FileText(db.Model):
+    """Content indexing state of a file; files without a row are still pending."""
+    __tablename__ = 'file_text'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), primary_key=True)
+    status = db.Column(db.String(16), nullable=False)  # indexed, unsupported, too_large, failed
+    term_count = db.Column(db.Integer, nullable=False, default=0)
+    indexed_at = db.Column(db.DateTime, nullable=False)
+
+class Posting(db.Model):
+    """Inverted index of file contents: one row per word per file."""
+    __tablename__ = 'posting'
+    __table_args__ = (
+        db.Index('ix_posting_file_id', 'file_id'),
+    )
+
+    term = db.Column(db.String(64), primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), primary_key=True)
+    tf = db.Column(db.Integer, nullable=False)  # occurrences of the term in the file
+
+class Job(db.Model):
+    """Background work queued in the same transaction as the change that
+    needs it; see jobs.JobQueue."""
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    # Idempotency key: enqueueing the same key again is a no-op while the job is kept
+    key = db.Column(db.String(255), unique=True)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(128))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+class Derivative(db.Model):
+    """Thumbnail and preview state of a stored object. Keyed by storage key,
+    so every file sharing a blob shares one set of renditions."""
+    __tablename__ = 'derivative'
+
+    source_key = db.Column(db.String(512), primary_key=True)
+    status = db.Column(db.String(16), nullable=False)  # ready, unsupported, too_large, failed
+    width = db.Column(db.Integer)  # of the original
+    height = db.Column(db.Integer)
+    rendered_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,158 @@
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+from flask.sessions import SessionInterface, SecureCookieSession
+from sqlalchemy import select, insert, update, delete
+
+
+# Stores map an opaque session id to a dict of session data with an expiry.
+# get() returns (data, expires_at) or None; expires_at is a Unix timestamp.
+class MemorySessionStore:
+    """Per-process store with LRU eviction. Only suitable for a single worker."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return entry[0], entry[1]
+
+    def set(self, sid, data, ttl, user_id=None):
+        with self._lock:
+            self._sessions[sid] = (dict(data), time.time() + ttl, user_id)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            sids = [sid for sid, entry in self._sessions.items() if entry[2] == user_id]
+            for sid in sids:
+                del self._sessions[sid]
+            return len(sids)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry[1] <= now]
+            for sid in expired:
+                del self._sessions[sid]
+            return len(expired)
+
+
+class DatabaseSessionStore:
+    """Store backed by a SQL table (id, user_id, data, expires_at), shared by
+    every worker. Uses its own connections so it never commits ORM state."""
+
+    def __init__(self, table, get_engine, purge_interval=300):
+        self.table = table
+        self.get_engine = get_engine
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+
+    def get(self, sid):
+        with self.get_engine().connect() as conn:
+            row = conn.execute(
+                select(self.table.c.data, self.table.c.expires_at).where(self.table.c.id == sid)
+            ).first()
+        if row is None:
+            return None
+        expires_at = row.expires_at.replace(tzinfo=timezone.utc).timestamp()
+        if expires_at <= time.time():
+            return None
+        return json.loads(row.data), expires_at
+
+    def set(self, sid, data, ttl, user_id=None):
+        values = {
+            'user_id': user_id,
+            'data': json.dumps(data),
+            'expires_at': datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=ttl)
+        }
+        with self.get_engine().begin() as conn:
+            updated = conn.execute(update(self.table).where(self.table.c.id == sid).values(**values)).rowcount
+            if not updated:
+                conn.execute(insert(self.table).values(id=sid, **values))
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self.purge_expired()
+
+    def delete(self, sid):
+        with self.get_engine().begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def delete_user(self, user_id):
+        with self.get_engine().begin() as conn:
+            return conn.execute(delete(self.table).where(self.table.c.user_id == user_id)).rowcount
+
+    def purge_expired(self):
+        self._last_purge = time.monotonic()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self.get_engine().begin() as conn:
+            return conn.execute(delete(self.table).where(self.table.c.expires_at <= now)).rowcount
+
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in `store`; the cookie only carries a random id."""
+
+    def __init__(self, store, ttl=86400):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        entry = self.store.get(sid) if sid else None
+        if entry is None:
+            return ServerSession()
+        data, expires_at = entry
+        return ServerSession(data, sid=sid, expires_at=expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Unchanged sessions are only rewritten to slide the expiry forward
+        # once half of the lifetime has passed
+        stale = session.expires_at is None or session.expires_at - time.time() < self.ttl / 2
+        if not session.modified and not stale:
+            return
+        sid = session.sid or secrets.token_urlsafe(32)
+        self.store.set(sid, dict(session), self.ttl, user_id=session.get('user_id'))
+        response.set_cookie(
+            name,
+            sid,
+            max_age=self.ttl,
+            domain=domain,
+            path=path,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
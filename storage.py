@@ -0,0 +1,331 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from itsdangerous import URLSafeSerializer, BadSignature
+
+
+S3_MIN_PART_SIZE = 5 * 1024 ** 2
+S3_MAX_DELETE_KEYS = 1000
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageBackend:
+    """Where file content lives. Keys are opaque strings such as
+    "blobs/ab/ab12..."; callers never build paths or URLs themselves."""
+
+    # Whether browsers can upload straight to the backend (presigned POST
+    # policies and multipart part URLs) instead of through the app
+    supports_direct_upload = False
+
+    def upload_fileobj(self, fileobj, key, content_type=None):
+        raise NotImplementedError
+
+    def open_writer(self, key, content_type=None):
+        """Return a writer with write(chunk), commit() and abort() for content
+        that arrives in pieces. Nothing is visible under key until commit()."""
+        raise NotImplementedError
+
+    def open(self, key, start=0, length=None):
+        """A readable binary stream of the content (read(n) and close()),
+        from byte `start`. With `length`, the backend only needs to fetch
+        that many bytes, so readers must stop there themselves."""
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def download_url(self, key, expires_in, filename=None):
+        """A time-limited URL for the content; `filename` is what the browser
+        shows and saves it as."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        """Delete several keys; returns the keys that could not be deleted."""
+        failed = []
+        for key in keys:
+            try:
+                self.delete(key)
+            except Exception:
+                failed.append(key)
+        return failed
+
+    # Direct uploads, only when supports_direct_upload is True
+    def presigned_post(self, key, content_type, max_size, expires_in):
+        raise NotImplementedError
+
+    def create_multipart_upload(self, key, content_type):
+        raise NotImplementedError
+
+    def presign_part(self, key, upload_id, part_number, expires_in):
+        raise NotImplementedError
+
+    def list_parts(self, key, upload_id):
+        raise NotImplementedError
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        raise NotImplementedError
+
+    def abort_multipart_upload(self, key, upload_id):
+        """Discard the parts of an upload. An upload that was already
+        completed or aborted is left as it is."""
+        raise NotImplementedError
+
+
+class S3Storage(StorageBackend):
+    """Objects in one S3 bucket. The client comes from `client_factory` and is
+    built once per process on first use: boto3 clients must not be shared
+    across a fork, so workers forked from a preloaded app each get their own
+    connection pool."""
+
+    supports_direct_upload = True
+
+    def __init__(self, client_factory, bucket, transfer_config=None):
+        self.client_factory = client_factory
+        self.bucket = bucket
+        self.transfer_config = transfer_config
+        self._client = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client_pid != os.getpid():
+            with self._client_lock:
+                if self._client_pid != os.getpid():
+                    self._client = self.client_factory()
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def upload_fileobj(self, fileobj, key, content_type=None):
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=extra_args, Config=self.transfer_config)
+
+    def open_writer(self, key, content_type=None):
+        return S3StreamWriter(self, key, content_type)
+
+    def open(self, key, start=0, length=None):
+        kwargs = {}
+        if length is not None:
+            kwargs['Range'] = f"bytes={start}-{start + length - 1}"
+        elif start:
+            kwargs['Range'] = f"bytes={start}-"
+        return self.client.get_object(Bucket=self.bucket, Key=key, **kwargs)['Body']
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def download_url(self, key, expires_in, filename=None):
+        params = {'Bucket': self.bucket, 'Key': key}
+        if filename:
+            params['ResponseContentDisposition'] = f'inline; filename="{filename}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires_in)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys):
+        failed = []
+        for start in range(0, len(keys), S3_MAX_DELETE_KEYS):
+            batch = keys[start:start + S3_MAX_DELETE_KEYS]
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        return failed
+
+    def presigned_post(self, key, content_type, max_size, expires_in):
+        return self.client.generate_presigned_post(
+            self.bucket,
+            key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 0, max_size]
+            ],
+            ExpiresIn=expires_in
+        )
+
+    def create_multipart_upload(self, key, content_type):
+        kwargs = {'ContentType': content_type} if content_type else {}
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=key, **kwargs)['UploadId']
+
+    def presign_part(self, key, upload_id, part_number, expires_in):
+        return self.client.generate_presigned_url('upload_part', Params={
+            'Bucket': self.bucket,
+            'Key': key,
+            'UploadId': upload_id,
+            'PartNumber': part_number
+        }, ExpiresIn=expires_in)
+
+    def upload_part(self, key, upload_id, part_number, body):
+        return self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)['ETag']
+
+    def list_parts(self, key, upload_id):
+        """All uploaded parts as dicts with PartNumber, ETag and Size."""
+        parts = []
+        kwargs = {'Bucket': self.bucket, 'Key': key, 'UploadId': upload_id}
+        while True:
+            response = self.client.list_parts(**kwargs)
+            parts.extend(response.get('Parts', []))
+            if not response.get('IsTruncated'):
+                return parts
+            kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts]}
+        )
+
+    def abort_multipart_upload(self, key, upload_id):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except self.client.exceptions.NoSuchUpload:
+            pass
+
+
+class S3StreamWriter:
+    """Buffers written data until it reaches the S3 minimum part size and
+    sends it as a multipart part. A body that never reaches that size is
+    sent with a single PUT instead."""
+
+    def __init__(self, storage, key, content_type=None):
+        self.storage = storage
+        self.key = key
+        self.content_type = content_type
+        self.upload_id = None
+        self.parts = []
+        self._pending = b''
+
+    def write(self, chunk):
+        self._pending += chunk
+        if len(self._pending) >= S3_MIN_PART_SIZE:
+            self._send_part()
+
+    def _send_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.storage.create_multipart_upload(self.key, self.content_type)
+        part_number = len(self.parts) + 1
+        etag = self.storage.upload_part(self.key, self.upload_id, part_number, self._pending)
+        self.parts.append({'PartNumber': part_number, 'ETag': etag})
+        self._pending = b''
+
+    def commit(self):
+        if self.upload_id is None:
+            kwargs = {'ContentType': self.content_type} if self.content_type else {}
+            self.storage.client.put_object(Bucket=self.storage.bucket, Key=self.key, Body=self._pending, **kwargs)
+        else:
+            if self._pending:
+                self._send_part()
+            self.storage.complete_multipart_upload(self.key, self.upload_id, self.parts)
+        self.upload_id = None
+        self._pending = b''
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.storage.abort_multipart_upload(self.key, self.upload_id)
+            self.upload_id = None
+        self._pending = b''
+
+
+class LocalStorage(StorageBackend):
+    """Files on local disk under `root`, spread over two levels of directories
+    by a hash of the key so no directory grows too large. Writes go to a temp
+    file in the target directory and are renamed into place atomically.
+    Download URLs are signed tokens resolved by `resolve_token`."""
+
+    def __init__(self, root, secret_key, url_builder):
+        self.root = root
+        self.url_builder = url_builder
+        self.signer = URLSafeSerializer(secret_key, salt='local-storage')
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def upload_fileobj(self, fileobj, key, content_type=None):
+        writer = self.open_writer(key, content_type)
+        try:
+            shutil.copyfileobj(fileobj, writer.file, 1024 * 1024)
+            writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+    def open_writer(self, key, content_type=None):
+        return LocalFileWriter(self.path(key))
+
+    def open(self, key, start=0, length=None):
+        try:
+            stream = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            raise StorageError(f"No object stored under {key}")
+        if start:
+            stream.seek(start)
+        return stream
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            raise StorageError(f"No object stored under {key}")
+
+    def download_url(self, key, expires_in, filename=None):
+        token = self.signer.dumps({'k': key, 'e': int(time.time()) + expires_in, 'n': filename})
+        return self.url_builder(token)
+
+    def resolve_token(self, token):
+        """Return (path, filename) for a download token, or raise StorageError."""
+        try:
+            data = self.signer.loads(token)
+        except BadSignature:
+            raise StorageError("Invalid download token")
+        if data['e'] < time.time():
+            raise StorageError("Download link has expired")
+        path = self.path(data['k'])
+        if not os.path.exists(path):
+            raise StorageError(f"No object stored under {data['k']}")
+        return path, data.get('n')
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class LocalFileWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.tmp-', delete=False)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.file.name, self.path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
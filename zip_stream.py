@@ -0,0 +1,144 @@
+import queue
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ZipEntry:
+    def __init__(self, name, key, size=None, date_time=None):
+        self.name = name
+        self.key = key
+        self.size = size
+        self.date_time = date_time
+
+
+class _OutputBuffer:
+    """Write target for ZipFile that hands whatever was written to the
+    response generator. It has no tell() or seek(), so ZipFile writes in
+    streaming mode (data descriptors after each entry)."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_END = object()
+
+
+class _Prefetch:
+    """Reads one entry on a worker thread into a bounded queue of chunks, so
+    memory per entry is at most `max_chunks` chunks however big the file."""
+
+    def __init__(self, open_entry, key, chunk_size, max_chunks, stopped):
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.open_entry = open_entry
+        self.key = key
+        self.chunk_size = chunk_size
+        self.stopped = stopped
+
+    def run(self):
+        try:
+            stream = self.open_entry(self.key)
+            try:
+                while not self.stopped.is_set():
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    self._put(chunk)
+            finally:
+                stream.close()
+            self._put(_END)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        while True:
+            item = self.chunks.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def stream_zip(entries, open_entry, prefetch=2, chunk_size=1024 ** 2, max_chunks=4):
+    """Yield a ZIP archive of `entries` as it is built.
+
+    `open_entry(key)` returns a readable binary stream. While one entry is
+    being written the next `prefetch` entries are already downloading, each
+    into at most `max_chunks` chunks of `chunk_size` bytes. Entries are
+    stored uncompressed; ZIP64 records are used wherever sizes or offsets
+    need them.
+    """
+    entries = list(entries)
+    stopped = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=prefetch + 1, thread_name_prefix='zip-prefetch')
+    readers = {}
+
+    def start(index):
+        if index < len(entries) and index not in readers:
+            reader = _Prefetch(open_entry, entries[index].key, chunk_size, max_chunks, stopped)
+            readers[index] = reader
+            executor.submit(reader.run)
+
+    output = _OutputBuffer()
+    try:
+        with zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for index, entry in enumerate(entries):
+                for ahead in range(index, index + prefetch + 1):
+                    start(ahead)
+                info = zipfile.ZipInfo(entry.name, date_time=entry.date_time or (1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_STORED
+                if entry.size is not None:
+                    info.file_size = entry.size
+                with archive.open(info, mode='w', force_zip64=entry.size is None) as dest:
+                    for chunk in readers.pop(index):
+                        dest.write(chunk)
+                        data = output.drain()
+                        if data:
+                            yield data
+                data = output.drain()
+                if data:
+                    yield data
+        # Central directory
+        data = output.drain()
+        if data:
+            yield data
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def unique_names(names):
+    """Make archive names unique by numbering repeats: "a.txt", "a (2).txt"."""
+    seen = set()
+    result = []
+    for name in names:
+        candidate = name
+        n = 1
+        while candidate.lower() in seen:
+            n += 1
+            stem, dot, ext = name.rpartition('.')
+            candidate = f"{stem} ({n}).{ext}" if dot and stem and '/' not in ext else f"{name} ({n})"
+        seen.add(candidate.lower())
+        result.append(candidate)
+    return result